@@ -0,0 +1,251 @@
+"""Benchmarks for the parsing module.
+
+Runs each workload on generated inputs of increasing size and reports the
+throughput and peak memory use, so scaling problems show up as a drop in
+throughput between sizes. Results can be saved as JSON and compared with an
+earlier run:
+
+    python bench_parsing.py --json before.json
+    python bench_parsing.py --compare before.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from parsing import *
+
+# Workloads: each builds a parser and generates an input of about n characters
+def csv_parser():
+    field = regex('[^,\n]*')
+    record = sep_by(field, ',')
+    return sep_by(record, '\n')
+
+def csv_input(n, rng):
+    rows = []
+    size = 0
+    while size < n:
+        row = ','.join(str(rng.randint(0, 10 ** rng.randint(1, 8))) for _ in range(8))
+        rows.append(row)
+        size += len(row) + 1
+    return '\n'.join(rows)
+
+def json_parser():
+    value = rule(name='value')
+    ws = ignored(optional(whitespace))
+    string = regex('"[^"\\\\]*"')
+    number = regex('-?[0-9]+(\\.[0-9]+)?')
+    array = '[' + ws + sep_by(value, ws + ',' + ws) + ws + ']'
+    pair = string + ws + ':' + ws + value
+    obj = '{' + ws + sep_by(pair, ws + ',' + ws) + ws + '}'
+    value.define(obj | array | string | number | 'true' | 'false' | 'null')
+    return value
+
+def json_input(n, rng):
+    def value(depth):
+        kind = rng.randint(0, 5 if depth < 6 else 3)
+        if kind == 0:
+            return str(rng.randint(-1000, 1000))
+        elif kind == 1:
+            return '"{}"'.format('x' * rng.randint(0, 12))
+        elif kind == 2:
+            return rng.choice(['true', 'false', 'null'])
+        elif kind == 3:
+            return '{}.{}'.format(rng.randint(0, 99), rng.randint(0, 99))
+        elif kind == 4:
+            return '[' + ', '.join(value(depth + 1) for _ in range(rng.randint(0, 4))) + ']'
+        else:
+            return '{' + ', '.join('"k{}": {}'.format(i, value(depth + 1))
+                                   for i in range(rng.randint(0, 4))) + '}'
+    items = []
+    size = 0
+    while size < n:
+        item = value(1)
+        items.append(item)
+        size += len(item) + 2
+    return '[' + ', '.join(items) + ']'
+
+def expr_parser():
+    expr = rule(name='expr')
+    term = rule(name='term')
+    factor = rule(name='factor')
+    number = regex('[0-9]+')
+    factor.define('(' + expr + ')' | number)
+    term.define(term + one_of(['*', '/']) + factor | factor)
+    expr.define(expr + one_of(['+', '-']) + term | term)
+    return expr
+
+def expr_input(n, rng):
+    def expr(depth):
+        if depth > 4 or rng.random() < 0.3:
+            return str(rng.randint(0, 999))
+        parts = [expr(depth + 1) for _ in range(rng.randint(2, 4))]
+        text = ''.join(part + rng.choice('+-*/') for part in parts[:-1]) + parts[-1]
+        return '(' + text + ')' if depth else text
+    parts = []
+    size = 0
+    while size < n:
+        part = expr(1)
+        parts.append(part)
+        size += len(part) + 1
+    return '+'.join(parts)
+
+def log_parser():
+    date = regex('[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}')
+    level = one_of(['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    line = date + ' ' + level + ' ' + regex('[a-z.]+') + ': ' + until('\n')
+    return many(line + '\n')
+
+def log_input(n, rng):
+    lines = []
+    size = 0
+    while size < n:
+        line = '2024-{:02}-{:02} {:02}:{:02}:{:02} {} app.{}: {}\n'.format(
+            rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59),
+            rng.randint(0, 59), rng.choice(['DEBUG', 'INFO', 'WARNING', 'ERROR']),
+            rng.choice(['db', 'http', 'cache']), 'message ' * rng.randint(1, 10))
+        lines.append(line)
+        size += len(line)
+    return ''.join(lines)
+
+def until_parser():
+    return '/*' + until('*/') + '*/'
+
+def until_input(n, rng):
+    body = ''.join(rng.choice('abc */\n') for _ in range(n))
+    return '/*' + body.replace('*/', '* /') + '*/'
+
+KEYWORDS = ['and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue',
+            'def', 'del', 'elif', 'else', 'except', 'finally', 'for', 'from', 'global',
+            'if', 'import', 'in', 'is', 'lambda', 'nonlocal', 'not', 'or', 'pass',
+            'raise', 'return', 'try', 'while', 'with', 'yield']
+
+def keywords_parser():
+    # Longest first, as alternatives are tried in order
+    keyword = one_of(sorted(KEYWORDS, key=len, reverse=True))
+    return sep_by(keyword | regex('[a-z_]+'), ' ')
+
+def keywords_input(n, rng):
+    words = KEYWORDS + ['name', 'value', 'item', 'x']
+    text = []
+    size = 0
+    while size < n:
+        word = rng.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)
+
+# Name: (parser factory, input generator, options for the parser call)
+WORKLOADS = {
+    'csv': (csv_parser, csv_input, {}),
+    # Lists nested in sequences need tree mode
+    'json': (json_parser, json_input, {'tree': True}),
+    'expr': (expr_parser, expr_input, {}),
+    'log': (log_parser, log_input, {}),
+    'until': (until_parser, until_input, {}),
+    'keywords': (keywords_parser, keywords_input, {}),
+}
+
+# Running
+def measure(parser, text, repeat, options):
+    """Return the best time out of ``repeat`` runs and the peak memory."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(text, **options)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    # Measured separately, as tracing slows parsing down
+    tracemalloc.start()
+    try:
+        parser(text, **options)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def run(names, sizes, repeat, compiled, seed, generated=False):
+    results = []
+    for name in names:
+        make_parser, make_input, options = WORKLOADS[name]
+        parser = make_parser()
+        if generated:
+            parser = parser.generate()
+        elif compiled:
+            parser = parser.compile()
+        for size in sizes:
+            text = make_input(size, random.Random(seed))
+            seconds, peak = measure(parser, text, repeat, options)
+            results.append({
+                'workload': name,
+                'size': len(text),
+                'seconds': seconds,
+                'throughput': len(text) / seconds if seconds else None,
+                'peak_memory': peak,
+            })
+            report(results[-1])
+    return results
+
+def report(result, baseline=None):
+    line = '{workload:<10} {size:>10} chars  {throughput:>12,.0f} chars/s  {peak_memory:>12,} bytes peak'
+    line = line.format(**result)
+    if baseline is not None and baseline.get('throughput') and result['throughput']:
+        change = result['throughput'] / baseline['throughput'] - 1
+        line += '  {:+.1%}'.format(change)
+    print(line)
+
+def compare(results, path):
+    with open(path) as file:
+        baseline = {(r['workload'], r['size']): r for r in json.load(file)['results']}
+    print('\nCompared with {}:'.format(path))
+    for result in results:
+        report(result, baseline.get((result['workload'], result['size'])))
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arguments.add_argument('workloads', nargs='*',
+                           help='workloads to run, out of {} (default: all)'.format(
+                               ', '.join(sorted(WORKLOADS))))
+    arguments.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')],
+                           default=[10000, 100000, 1000000],
+                           help='comma-separated input sizes, in characters')
+    arguments.add_argument('--repeat', type=int, default=3,
+                           help='runs per measurement; the best is kept')
+    arguments.add_argument('--compile', action='store_true',
+                           help='benchmark compiled parsers')
+    arguments.add_argument('--generate', action='store_true',
+                           help='benchmark parsers running as generated code')
+    arguments.add_argument('--seed', type=int, default=0,
+                           help='random seed for the generated inputs')
+    arguments.add_argument('--json', metavar='FILE',
+                           help='write the results to FILE as JSON')
+    arguments.add_argument('--compare', metavar='FILE',
+                           help='compare throughput with results saved with --json')
+    options = arguments.parse_args(argv)
+
+    # Deeply nested inputs recurse deeply
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    names = options.workloads or sorted(WORKLOADS)
+    for name in names:
+        if name not in WORKLOADS:
+            arguments.error('unknown workload {!r}'.format(name))
+    results = run(names, options.sizes, options.repeat, options.compile, options.seed,
+                  options.generate)
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({
+                'python': sys.version.split()[0],
+                'compiled': options.compile,
+                'generated': options.generate,
+                'sizes': options.sizes,
+                'results': results,
+            }, file, indent=2)
+    if options.compare:
+        compare(results, options.compare)
+
+if __name__ == '__main__':
+    main()
@@ -24,41 +24,274 @@
 __author__ = 'Darren M. Struthers <dstruthers@gmail.com>'
 __version__ = '1.0.0-dev'
 
+import bisect
+import collections
 import collections.abc
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import importlib
+import importlib.util
+import io
+import mmap
+import os
+import pickle
 import re
+import time
+
+try:
+    from re import _constants as _sre, _parser as _sre_parse, _compiler as _sre_compile
+except ImportError: # Python < 3.11
+    import sre_constants as _sre, sre_parse as _sre_parse, sre_compile as _sre_compile
 
 # Core classes
 class Parser(object):
+    __slots__ = ()
     def parse(self, input):
         raise NotImplementedError
 
+    def parse_iter(self, source, separator=None, terminator=None, memoize=False, tree=False):
+        """Apply the parser repeatedly, yielding each result as it completes.
+
+        Records may be delimited by a ``separator`` between them or a
+        ``terminator`` after each one. Memoized outcomes are dropped after
+        every record, and streamed input is released as it is consumed.
+        """
+        input = Input.coerce(source, memoize=memoize, tree=tree)
+        separator = None if separator is None else self.coerce(separator)
+        terminator = None if terminator is None else self.coerce(terminator)
+
+        while input:
+            yield self._parse_record(input, separator, terminator)
+
+    async def parse_async(self, source, separator=None, terminator=None, memoize=False,
+                          tree=False, chunk_size=65536, lookahead=1024):
+        """Asynchronous parse_iter, for ``async for`` over the results.
+
+        ``source`` is an asyncio.StreamReader or an async iterable of chunks,
+        which is read as the parser needs more data. A record that runs out of
+        data before the end of the stream is resumed once more of it has
+        arrived, as with parse_resumable. As with StreamInput, regular
+        expressions wait to see ``lookahead`` characters (or the end of the
+        stream) past the cursor, so interactive protocols may need a smaller
+        ``lookahead``.
+        """
+        input = PushInput(lookahead=lookahead, memoize=memoize, tree=tree)
+        chunks = _async_chunks(source, chunk_size).__aiter__()
+        separator = None if separator is None else self.coerce(separator)
+        terminator = None if terminator is None else self.coerce(terminator)
+
+        while True:
+            start = input.pos
+            # Keep the record buffered in case it has to be parsed again
+            input.begin()
+            try:
+                if not input:
+                    return
+                try:
+                    result = self._parse_record(input, separator, terminator)
+                except ParserError as e:
+                    raise input.furthest_error(e)
+            except _NeedData:
+                input._restart(start)
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    input.close()
+                else:
+                    input.feed(chunk)
+            else:
+                input.commit()
+                input._checkpoints.clear()
+                yield result
+
+    def parse_resumable(self, data, memoize=True, tree=False, lookahead=1024):
+        """Start parsing ``data``, which may be only the beginning of the input.
+
+        Returns the result if it could be parsed from ``data`` alone, as a
+        Partial if some of ``data`` was left over, or a Suspended parse to
+        ``feed`` the rest of the input to as it arrives. Each resumption
+        carries on from where the repetitions, sequences and alternatives
+        being parsed were interrupted, so only the parsers that were cut short
+        are started over. With ``memoize``, other parsers that finished before
+        the input ran out aren't redone either.
+        """
+        input = PushInput(lookahead=lookahead, memoize=memoize, tree=tree)
+        input.feed(data)
+        return self._resume(input)
+
+    def _resume(self, input):
+        input._restart(input._offset)
+        input.begin()
+        try:
+            try:
+                result = self(input)
+            except ParserError as e:
+                input._checkpoints.clear()
+                raise input.furthest_error(e)
+        except _NeedData:
+            return Suspended(self, input)
+        input.commit()
+        input._checkpoints.clear()
+        remainder = input._remainder()
+        if len(remainder):
+            return Partial(result, remainder)
+        return result
+
+    def _parse_record(self, input, separator, terminator):
+        start = input.pos
+        # Keyed on None, as the record isn't any one parser
+        checkpoint = input._checkpoints and input._checkpoints.pop((None, start), None)
+        if checkpoint:
+            result, input.pos = checkpoint
+        else:
+            result = self(input)
+        end = input.pos
+        try:
+            if terminator is not None:
+                terminator(input)
+            if input and separator is not None:
+                separator(input)
+                if not input:
+                    raise mismatch(expected='record after separator')
+        except _NeedData:
+            input._suspend(None, start, (result, end))
+            raise
+        if input.pos == start:
+            raise ParserError('Parser made no progress at position {}'.format(start))
+        input._rules = None
+        if input.memo is not None:
+            input.memo.clear()
+        return result
+
+    def parse_many(self, values, errors='raise', memoize=False, executor=None, batch_size=1000):
+        """Parse each of ``values`` separately, yielding the results in order.
+
+        A single Input is reused from one value to the next. When a value
+        fails to parse, its ParserError is raised if ``errors`` is 'raise',
+        yielded in place of the result with 'return', or left out with
+        'skip'. Given a concurrent.futures ``executor``, the values are
+        parsed there in batches of ``batch_size``; a process pool needs a
+        picklable parser.
+        """
+        if errors not in ('raise', 'return', 'skip'):
+            raise ValueError('errors must be raise, return or skip, not {!r}'.format(errors))
+        if executor is not None:
+            # Only a few batches are in flight at once, so values are read
+            # as they're needed rather than all up front
+            pending = collections.deque()
+            limit = 2 * (os.cpu_count() or 1)
+            try:
+                for batch in _batches(values, batch_size):
+                    pending.append(executor.submit(_parse_batch, self, batch, errors, memoize))
+                    if len(pending) >= limit:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+            return
+
+        input = None
+        for value in values:
+            if input is None:
+                input = Input(value, memoize=memoize)
+            else:
+                input.reset(value)
+            try:
+                result = self(input)
+            except ParserError as e:
+                error = input.furthest_error(e)
+                # The error refers to the input, so leave it be
+                input = None
+                if errors == 'raise':
+                    raise error
+                elif errors == 'return':
+                    yield error
+            else:
+                yield result
+
+    def compile(self):
+        """Return an optimized parser equivalent to this one.
+
+        Nested sequences and alternatives are flattened, adjacent constants
+        merged and repetitions of simple parsers turned into single regular
+        expressions. The original grammar is left untouched.
+        """
+        return _Compiler().compile(self)
+
+    def generate(self, cache=True):
+        """Return an equivalent parser running as generated Python code.
+
+        The compiled grammar is translated into a module of plain functions,
+        one per parser, which track the position in local variables and
+        match literals inline. Parts that can't be translated, such as
+        @parser functions or mutually left-recursive rules, are called as
+        they are.
+        The module is saved in ``cache`` (a directory, or True for the
+        user's cache directory) under a hash of the grammar's structure, so
+        each grammar is only translated once. Only str and bytes in a plain
+        Input, without memoization or tree mode, are parsed by the generated
+        code; anything else goes to the compiled grammar.
+        """
+        return _Generator(self.compile()).load(cache)
+
+    def _compile(self, compiler):
+        return self
+
+    def first(self):
+        """Return the set of items the parser's match can start with.
+
+        The result is a pair (items, nullable): ``items`` is a set of length-1
+        slices of the input type, or None when unknown, and ``nullable`` says
+        whether the parser may succeed without consuming anything.
+        """
+        return _first(self, {})
+
+    def _first(self, firsts):
+        return None, True
+
+    def describe(self):
+        """Describe what the parser expects, for error messages."""
+        return getattr(self, 'desc', None) or self.__class__.__name__
+
     def separated_by(self, sep):
         return sep_by(self, sep)
 
     def surrounded_by(self, outer):
         return self.coerce(outer) + self + self.coerce(outer)
 
-    def __call__(self, input):
+    def __call__(self, input, memoize=False, tree=False):
         if isinstance(input, Input):
+            if input.packrat:
+                return input.memo.apply(self, input)
             return self.parse(input)
-        else:
-            return self.parse(Input(input))
 
+        input = Input.coerce(input, memoize=memoize, tree=tree)
+        try:
+            return self(input)
+        except ParserError as e:
+            raise input.furthest_error(e)
+
+    # Sequences being built up are extended in place; shared ones, such as
+    # trimmed() returns, are subclasses and left alone
     def __add__(self, other):
-        if isinstance(other, sequence):
+        if type(other) is sequence:
             other.insert(0, self)
             return other
-        elif isinstance(self, sequence):
+        elif type(self) is sequence:
             self.append(self.coerce(other))
             return self
         else:
             return sequence([self, self.coerce(other)])
 
     def __radd__(self, other):
-        if isinstance(other, sequence):
+        if type(other) is sequence:
             other.append(self)
             return other
-        elif isinstance(self, sequence):
+        elif type(self) is sequence:
             self.insert(0, self.coerce(other))
             return self
         else:
@@ -104,7 +337,7 @@ class Parser(object):
             return obj
         elif isinstance(obj, QualifiedResult):
             return constant(obj.result)
-        elif isinstance(obj, str):
+        elif isinstance(obj, (str, bytes)):
             return constant(obj)
         elif isinstance(obj, collections.abc.Iterable):
             return sequence(obj)
@@ -112,15 +345,41 @@ class Parser(object):
             return constant(obj)
 
 class repeat(Parser):
+    __slots__ = ('parser', 'times')
     def __init__(self, parser, times):
         self.parser = self.coerce(parser)
         self.times = times
 
     def parse(self, input):
-        parsed = Nil
-        for i in range(0, self.times):
-            parsed += self.parser(input)
-        return parsed
+        parser = self.parser
+        start = input.pos
+        results = []
+        checkpoint = input._checkpoints and input._checkpoints.pop((self, start), None)
+        if checkpoint:
+            results, input.pos = checkpoint
+        last = input.pos
+        try:
+            for i in range(len(results), self.times):
+                results.append(parser(input))
+                last = input.pos
+        except _NeedData:
+            input._suspend(self, start, (results, last))
+            raise
+        return _concat(results)
+
+    def _first(self, firsts):
+        if self.times == 0:
+            return frozenset(), True
+        return _first(self.parser, firsts)
+
+    def _compile(self, compiler):
+        parser = compiler.compile(self.parser)
+        if self.times == 1:
+            return parser
+        elif isinstance(parser, constant) and isinstance(parser.value, (str, bytes)):
+            return constant(parser.value * self.times)
+        else:
+            return repeat(parser, self.times)
 
     def __mul__(self, other):
         return repeat(self.parser, self.times * other)
@@ -129,60 +388,191 @@ class repeat(Parser):
         return repeat(self.parser, self.times * other)
     
 class UnaryCombinator(Parser):
+    __slots__ = ('parser',)
     def __init__(self, parser):
         self.parser = self.coerce(parser)
 
+    def _first(self, firsts):
+        return _first(self.parser, firsts)
+
+    def _compile(self, compiler):
+        parser = compiler.compile(self.parser)
+        if parser is self.parser:
+            return self
+        compiled = copy.copy(self)
+        compiled.parser = parser
+        return compiled
+
 class BinaryCombinator(Parser):
+    __slots__ = ('parser1', 'parser2')
     def __init__(self, parser1, parser2):
         self.parser1 = self.coerce(parser1)
         self.parser2 = self.coerce(parser2)
 
+    def _compile(self, compiler):
+        compiled = copy.copy(self)
+        compiled.parser1 = compiler.compile(self.parser1)
+        compiled.parser2 = compiler.compile(self.parser2)
+        return compiled
+
 class MultaryCombinator(Parser):
+    __slots__ = ('parsers',)
     def __init__(self, parsers):
         self.parsers = [self.coerce(p) for p in parsers]
 
+    def _compile(self, compiler):
+        parsers = []
+        for parser in self.parsers:
+            parser = compiler.compile(parser)
+            # Nesting the same combinator is associative
+            if type(parser) is type(self):
+                parsers.extend(parser.parsers)
+            else:
+                parsers.append(parser)
+        return type(self)(parsers)
+
 class Input(object):
-    def __init__(self, value):
-        if not isinstance(value, collections.abc.Sequence):
+    """Cursor over an unchanging buffer.
+
+    Parsers advance ``pos`` instead of slicing the buffer, so saving and
+    restoring a position with ``begin``/``rollback`` is just an integer.
+
+    Any sequence can be parsed, as well as mmap objects. Binary buffers
+    (bytes, bytearray, mmap and memoryview) are matched in place, and results
+    are slices of the buffer's own type (bytes for mmap), so only the matched
+    spans are ever copied.
+
+    With ``memoize`` set (True, or a MemoTable to use), every parser call is
+    cached by position, i.e. the input is parsed in packrat mode.
+
+    With ``tree`` set, named rules return Node objects, building a parse tree
+    instead of concatenated results.
+    """
+    __slots__ = ('buffer', 'pos', '_stack', 'memo', 'packrat', 'tree', 'volatile', '_rules',
+                 'furthest', '_expected', '_newlines', '_checkpoints')
+    def __init__(self, value, memoize=False, tree=False):
+        if isinstance(memoize, MemoTable):
+            self.memo = memoize
+        elif memoize:
+            self.memo = MemoTable()
+        else:
+            self.memo = None
+        self.packrat = self.memo is not None
+        self.tree = tree
+        self._start(value)
+
+    def reset(self, value):
+        """Start over on a new value, as a fresh Input with the same options."""
+        self._start(value)
+        if self.memo is not None:
+            self.memo.clear()
+
+    def _start(self, value):
+        if not isinstance(value, (collections.abc.Sequence, mmap.mmap)):
             raise TypeError('{} not a sequence type.'.format(value.__class__))
-        self.value = value
-        self._consumed = ''
+        self.buffer = value
+        self.pos = 0
         self._stack = []
+        # Bumped whenever a provisional left-recursive result is handed out;
+        # outcomes computed meanwhile must not be cached.
+        self.volatile = 0
+        self._rules = None
+        # Furthest position any parser failed at, and what was expected there
+        self.furthest = -1
+        self._expected = {}
+        self._newlines = None
+        # How far interrupted parsers got, on a PushInput
+        self._checkpoints = None
+
+    @property
+    def value(self):
+        """The remaining (unconsumed) input."""
+        return self.buffer[self.pos:]
 
     def begin(self):
-        self._stack.append((self.value, self._consumed))
+        self._stack.append(self.pos)
 
     def commit(self):
         self._stack.pop()
         
     def consume(self, chars):
-        if len(self.value) >= chars:
-            consumed = self.value[0:chars]
-            self._consumed += consumed
-            self.value = self.value[chars:]
-            return consumed
+        start = self.pos
+        end = start + chars
+        if end <= len(self.buffer):
+            self.pos = end
+            return self.buffer[start:end]
         else:
             raise EndOfInputError('End of input or insufficient input for request')
 
     def match(self, parser):
         if not isinstance(parser, Parser):
             parser = Parser.coerce(parser)
-        saved_value = self.value
+        start = self.pos
         result = parser(self)
-        matched = saved_value[0:len(saved_value) - len(self.value)]
-        return Match(result, matched)
+        return Match(result, input=self, start=start, end=self.pos)
+
+    def match_regex(self, regexp):
+        """Return the end offset of ``regexp`` matched at the cursor, or None."""
+        matched = regexp.match(self.buffer, self.pos)
+        if matched:
+            return matched.end()
+        return None
+
+    def find(self, value):
+        """Return the position of the next occurrence of ``value``, or None."""
+        try:
+            found = self.buffer.find(value, self.pos)
+        except (AttributeError, TypeError):
+            # memoryview has no find(), but re can search it
+            try:
+                return self.search_regex(re.compile(re.escape(value)))
+            except TypeError:
+                return None
+        return found if found >= 0 else None
+
+    def search_regex(self, regexp):
+        """Return the position of the next match of ``regexp``, or None."""
+        matched = regexp.search(self.buffer, self.pos)
+        if matched:
+            return matched.start()
+        return None
+
+    def next_item(self):
+        """Return the next item as a length-1 slice, empty at the end."""
+        return self.buffer[self.pos:self.pos + 1]
 
     def rollback(self):
-        self.value, self._consumed = self._stack.pop()
+        self.pos = self._stack.pop()
+
+    def slice(self, start, end):
+        """Return the input between two absolute positions."""
+        return self.buffer[start:end]
+
+    def startswith(self, value):
+        """Test whether the remaining input begins with ``value``."""
+        try:
+            return self.buffer.startswith(value, self.pos)
+        except (AttributeError, TypeError):
+            return self.buffer[self.pos:self.pos + len(value)] == value
+
+    def __bool__(self):
+        return self.pos < len(self.buffer)
 
     def __eq__(self, other):
         return self.value == other
 
     def __getitem__(self, offset):
-        return self.value[offset]
+        if isinstance(offset, slice):
+            start, stop, step = offset.indices(len(self))
+            return self.buffer[self.pos + start:self.pos + stop:step]
+        if offset < 0:
+            offset += len(self)
+        if not 0 <= offset < len(self):
+            raise IndexError('Input index out of range')
+        return self.buffer[self.pos + offset]
 
     def __len__(self):
-        return len(self.value)
+        return len(self.buffer) - self.pos
 
     def __radd__(self, other):
         return other + self.value
@@ -190,7 +580,843 @@ class Input(object):
     def __repr__(self):
         return repr(self.value)
 
+    def furthest_error(self, error=None):
+        """Return an error describing the furthest failure so far.
+
+        ``error`` is returned as is if it lies further, and if it lies just as
+        far, what else was expected there is added to it.
+        """
+        if error is not None and (self.furthest < 0 or
+                                  error.pos is not None and error.pos > self.furthest):
+            return error
+        if error is not None and error.pos == self.furthest:
+            own = error.parser if error.expected is None else error.expected
+            if error.args or own is None:
+                # An explicit message says all there is to say
+                return error
+            own = list(own) if isinstance(own, (list, tuple, dict)) else [own]
+            expected = dict(self._expected)
+            for item in own:
+                expected.setdefault(item)
+            if len(expected) == len(set(own)):
+                return error
+            return type(error)(expected=expected, input=self, pos=error.pos, parser=error.parser)
+        cls = ParserError if self._has(self.furthest) else EndOfInputError
+        return cls(expected=dict(self._expected), input=self, pos=self.furthest)
+
+    def line_col(self, pos):
+        """Return the 1-based (line, column) of ``pos``."""
+        if self._newlines is None:
+            newline = _newline(self.buffer)
+            if newline is None:
+                self._newlines = []
+            else:
+                self._newlines = [m.start() for m in re.finditer(re.escape(newline), self.buffer)]
+        line = bisect.bisect_left(self._newlines, pos)
+        start = self._newlines[line - 1] + 1 if line else 0
+        return line + 1, pos - start + 1
+
+    def _failed(self, pos, expected):
+        if pos > self.furthest:
+            self.furthest = pos
+            self._expected = {expected: None}
+        elif pos == self.furthest:
+            self._expected[expected] = None
+
+    def _has(self, pos):
+        return pos < len(self.buffer)
+
+    # How far parsing has looked, only tracked by IncrementalInput
+    reach = None
+
+    def _examine(self, end):
+        pass
+
+    def excerpt(self, pos, width=40):
+        """Return a bounded repr of the input at ``pos``, or '' at the end."""
+        text = self.buffer[pos:pos + width]
+        if isinstance(text, memoryview):
+            text = text.tobytes()
+        if not len(text):
+            return ''
+        elif pos + width < len(self.buffer):
+            return repr(text) + '...'
+        else:
+            return repr(text)
+
+    @staticmethod
+    def coerce(value, **options):
+        if isinstance(value, Input):
+            return value
+        elif isinstance(value, (collections.abc.Sequence, mmap.mmap)):
+            # mmaps have read() too, but are matched in place
+            return Input(value, **options)
+        elif hasattr(value, 'read') or isinstance(value, collections.abc.Iterator):
+            return StreamInput(value, **options)
+        else:
+            return Input(value, **options)
+
+_TEXT_BUFFERS = (str, bytes, bytearray, memoryview, mmap.mmap)
+
+def _newline(buffer):
+    if isinstance(buffer, str):
+        return '\n'
+    elif isinstance(buffer, (bytes, bytearray, memoryview, mmap.mmap)):
+        return b'\n'
+    return None
+
+def _read_chunks(file, size):
+    while True:
+        chunk = file.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+class StreamInput(Input):
+    """Input pulled on demand from a file object or an iterable of chunks.
+
+    Positions are absolute offsets into the stream, but only the data from
+    the oldest open begin() mark (or the cursor, if there is none) onwards
+    stays buffered. Regular expressions see at least ``lookahead`` characters
+    past the cursor; a match running into the end of the buffer is retried
+    with more data.
+    """
+    __slots__ = ('_chunks', '_offset', '_eof', '_lines', '_line_start', 'chunk_size', 'lookahead')
+    def __init__(self, source, chunk_size=65536, lookahead=1024, memoize=False, tree=False):
+        if hasattr(source, 'read'):
+            source = _read_chunks(source, chunk_size)
+        self._chunks = iter(source)
+        self._offset = 0
+        self._eof = False
+        # Newlines in discarded input, and where the last discarded line began
+        self._lines = 0
+        self._line_start = 0
+        self.chunk_size = chunk_size
+        self.lookahead = lookahead
+        first = self._next_chunk()
+        super(StreamInput, self).__init__(first if first is not None else '', memoize=memoize, tree=tree)
+
+    def _next_chunk(self):
+        if not self._eof:
+            for chunk in self._chunks:
+                if chunk:
+                    return chunk
+            self._eof = True
+        return None
+
+    def _read(self):
+        chunk = self._next_chunk()
+        if chunk is None:
+            return False
+        keep = (self._stack[0] if self._stack else self.pos) - self._offset
+        kept = self.buffer
+        if keep > 0:
+            newline = _newline(kept)
+            if newline is not None:
+                self._lines += kept.count(newline, 0, keep)
+                last = kept.rfind(newline, 0, keep)
+                if last >= 0:
+                    self._line_start = self._offset + last + 1
+            kept = kept[keep:]
+            self._offset += keep
+        # Read at least as much again as is kept, so that holding on to a
+        # lot of input copies it a few times rather than once per chunk
+        chunks = [kept, chunk]
+        size = len(chunk)
+        while size < len(kept):
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        try:
+            self.buffer = kept[:0].join(chunks)
+        except (AttributeError, TypeError):
+            # Sequences such as lists have no join
+            self.buffer = kept
+            for chunk in chunks[1:]:
+                self.buffer = self.buffer + chunk
+        return True
+
+    def _fill(self, end):
+        """Buffer the stream up to absolute position ``end`` if possible."""
+        while self._offset + len(self.buffer) < end:
+            if not self._read():
+                return False
+        return True
+
+    def _fill_all(self):
+        while self._read():
+            pass
+
+    @property
+    def value(self):
+        self._fill_all()
+        return self.buffer[self.pos - self._offset:]
+
+    def consume(self, chars):
+        end = self.pos + chars
+        if not self._fill(end):
+            raise EndOfInputError('End of input or insufficient input for request')
+        start = self.pos - self._offset
+        self.pos = end
+        return self.buffer[start:start + chars]
+
+    def match(self, parser):
+        self.begin()
+        try:
+            match = super(StreamInput, self).match(parser)
+            # The span may not stay buffered
+            match.matched
+            return match
+        finally:
+            self.commit()
+
+    def match_regex(self, regexp):
+        self._fill(self.pos + max(self.lookahead, 1))
+        while True:
+            matched = regexp.match(self.buffer, self.pos - self._offset)
+            if not matched or matched.end() < len(self.buffer) or not self._read():
+                break
+        if matched:
+            return matched.end() + self._offset
+        return None
+
+    def find(self, value):
+        start = self.pos
+        while True:
+            try:
+                found = self.buffer.find(value, start - self._offset)
+            except (AttributeError, TypeError):
+                return super(StreamInput, self).find(value)
+            if found >= 0:
+                return found + self._offset
+            # An occurrence may straddle the end of the buffer
+            start = max(start, self._offset + len(self.buffer) - len(value) + 1)
+            if not self._read():
+                return None
+
+    def search_regex(self, regexp):
+        start = self.pos
+        while True:
+            end = self._offset + len(self.buffer)
+            matched = regexp.search(self.buffer, start - self._offset)
+            found = matched.start() + self._offset if matched else end
+            # As in match_regex, a position is settled once the regex sees
+            # lookahead characters past it, or matches short of the end
+            if matched and matched.end() + self._offset < end and found + self.lookahead <= end:
+                return found
+            start = max(start, min(found, end - self.lookahead))
+            if not self._read():
+                return found if matched else None
+
+    def next_item(self):
+        self._fill(self.pos + 1)
+        start = self.pos - self._offset
+        return self.buffer[start:start + 1]
+
+    def slice(self, start, end):
+        if start < self._offset:
+            raise ValueError('Input at position {} has been discarded'.format(start))
+        self._fill(end)
+        return self.buffer[start - self._offset:end - self._offset]
+
+    def startswith(self, value):
+        self._fill(self.pos + len(value))
+        start = self.pos - self._offset
+        try:
+            return self.buffer.startswith(value, start)
+        except (AttributeError, TypeError):
+            return self.buffer[start:start + len(value)] == value
+
+    def __bool__(self):
+        return self._fill(self.pos + 1)
+
+    def __getitem__(self, offset):
+        if isinstance(offset, slice) and offset.stop is not None and offset.stop >= 0:
+            self._fill(self.pos + offset.stop)
+        elif not isinstance(offset, slice) and offset >= 0:
+            self._fill(self.pos + offset + 1)
+        else:
+            self._fill_all()
+        return self.buffer[self.pos - self._offset:][offset]
+
+    def __len__(self):
+        self._fill_all()
+        return self._offset + len(self.buffer) - self.pos
+
+    def __repr__(self):
+        return repr(self.buffer[self.pos - self._offset:])
+
+    def line_col(self, pos):
+        if pos < self._offset:
+            return None
+        end = pos - self._offset
+        newline = _newline(self.buffer)
+        if newline is None:
+            return 1, pos + 1
+        last = self.buffer.rfind(newline, 0, end)
+        start = self._offset + last + 1 if last >= 0 else self._line_start
+        return self._lines + self.buffer.count(newline, 0, end) + 1, pos - start + 1
+
+    def _has(self, pos):
+        return self._fill(pos + 1)
+
+    def excerpt(self, pos, width=40):
+        if pos < self._offset:
+            return '(discarded input)'
+        start = pos - self._offset
+        text = self.buffer[start:start + width]
+        if not len(text):
+            return '' if self._eof else '(unread input)'
+        elif start + width < len(self.buffer) or not self._eof:
+            return repr(text) + '...'
+        else:
+            return repr(text)
+
+class _NeedData(Exception):
+    """A PushInput ran out of data before being closed."""
+
+class PushInput(StreamInput):
+    """StreamInput of data handed over by ``feed`` as it arrives.
+
+    Until ``close`` is called, a parser needing data beyond what has been fed
+    is interrupted, rather than failing, so it can be run again later.
+    Repetitions, sequences and alternatives record how far they got when
+    interrupted, and carry on from there when run again at the same position.
+    """
+    __slots__ = ('_pending', '_closed')
+
+    def __init__(self, lookahead=1024, memoize=False, tree=False):
+        self._pending = collections.deque()
+        self._closed = False
+        super(PushInput, self).__init__((), lookahead=lookahead, memoize=memoize, tree=tree)
+        self._checkpoints = {}
+
+    def feed(self, data):
+        if not len(data):
+            return
+        if not len(self.buffer) and type(self.buffer) is not type(data):
+            # Take on the type of the data
+            self.buffer = data[:0]
+        self._pending.append(data)
+
+    def close(self):
+        self._closed = True
+
+    def _remainder(self):
+        """Return the data fed but not consumed."""
+        rest = self.buffer[self.pos - self._offset:]
+        return rest + rest[:0].join(self._pending)
+
+    def _next_chunk(self):
+        if self._pending:
+            return self._pending.popleft()
+        if self._closed:
+            self._eof = True
+        return None
+
+    def _read(self):
+        if not self._pending and not self._closed:
+            raise _NeedData()
+        return super(PushInput, self)._read()
+
+    def _suspend(self, parser, pos, state):
+        """Record the ``state`` ``parser``, run at ``pos``, ran out of data in."""
+        # Progress made on a provisional left-recursive result isn't final
+        if not self.volatile:
+            self._checkpoints[(parser, pos)] = state
+
+    def _restart(self, pos):
+        """Prepare to run a parser again from ``pos``."""
+        self.pos = pos
+        del self._stack[:]
+        self._rules = None
+        self.volatile = 0
+
+class Suspended(object):
+    """A parse that ran out of input, as returned by Parser.parse_resumable.
+
+    ``feed`` and ``close`` resume it, returning what parse_resumable would
+    have: the result, a Partial, or a Suspended parse again.
+    """
+    __slots__ = ('parser', 'input')
+
+    def __init__(self, parser, input):
+        self.parser = parser
+        self.input = input
+
+    def feed(self, data):
+        """Resume with the next piece of the input."""
+        self.input.feed(data)
+        return self.parser._resume(self.input)
+
+    def close(self):
+        """Resume knowing that the input is complete."""
+        self.input.close()
+        return self.parser._resume(self.input)
+
+    def __repr__(self):
+        return '<Suspended {} at position {}>'.format(self.parser.describe(), self.input.pos)
+
+async def _async_chunks(source, size):
+    if hasattr(source, 'read'):
+        while True:
+            chunk = await source.read(size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+class MemoTable(object):
+    """Bounded LRU cache of (parser, position) -> parse outcome."""
+    __slots__ = ('maxsize', 'hits', 'misses', '_entries')
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def apply(self, parser, input):
+        key = (parser, input.pos)
+        entries = self._entries
+        entry = entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            result, end, error = entry
+            input.pos = end
+            if error is not None:
+                raise error.with_traceback(None)
+            return result
+
+        self.misses += 1
+        volatile = input.volatile
+        try:
+            result = parser.parse(input)
+        except ParserError as e:
+            if input.volatile == volatile:
+                self._store(key, (None, input.pos, e))
+            raise
+        if input.volatile == volatile:
+            self._store(key, (result, input.pos, None))
+        return result
+
+    def clear(self):
+        """Drop every cached outcome, keeping the hit/miss counters."""
+        self._entries.clear()
+
+    def _store(self, key, entry):
+        entries = self._entries
+        entries[key] = entry
+        if self.maxsize is not None and len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+# Positions spanned by each block of an _IncrementalMemo
+_MEMO_BLOCK = 1024
+
+class _MemoBlock(object):
+    """Outcomes memoized over a run of positions, keyed ``delta`` before them."""
+    __slots__ = ('delta', 'entries', 'top', 'reach')
+    def __init__(self, delta):
+        self.delta = delta
+        self.entries = {}
+        self.top = self.reach = 0
+
+    def bound(self):
+        """Recompute the last position and furthest reach of the outcomes."""
+        self.top = max((pos for parser, pos in self.entries), default=0)
+        self.reach = max((key[1] + entry[3] for key, entry in self.entries.items()), default=0)
+
+class _IncrementalMemo(MemoTable):
+    """MemoTable also recording how far each parser call looked ahead.
+
+    Outcomes are kept in blocks of consecutive positions, each keyed by
+    position less its block's ``delta``, so an edit moves everything after
+    it by changing a few deltas. The recorded results are moved along with
+    them when they're next used. Blocks rather than single outcomes are
+    evicted once there are more than ``maxsize`` outcomes.
+    """
+    __slots__ = ('_starts', '_blocks', '_size')
+    def __init__(self, maxsize=None):
+        super(_IncrementalMemo, self).__init__(maxsize)
+        self.clear()
+
+    def apply(self, parser, input):
+        pos = input.pos
+        index = bisect.bisect_right(self._starts, pos) - 1
+        block = self._blocks[index]
+        key = (parser, pos - block.delta)
+        entry = block.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(block)
+            result, error, length, looked, origin = entry
+            if origin != pos:
+                shifted = {}
+                result = _shifted(result, pos - origin, shifted)
+                error = _shifted(error, pos - origin, shifted)
+                block.entries[key] = (result, error, length, looked, pos)
+            input._examine(pos + looked)
+            input.pos = pos + length
+            if error is not None:
+                raise error.with_traceback(None)
+            return result
+
+        self.misses += 1
+        volatile = input.volatile
+        outer = input.reach
+        input.reach = pos
+        result = error = None
+        try:
+            result = parser.parse(input)
+        except ParserError as e:
+            error = e
+        finally:
+            reach = input.reach
+            if outer > reach:
+                input.reach = outer
+        if input.volatile == volatile:
+            self._store((parser, pos), (result, error, input.pos - pos, reach - pos, pos))
+        if error is not None:
+            raise error
+        return result
+
+    def clear(self):
+        """Drop every cached outcome, keeping the hit/miss counters."""
+        self._entries.clear()
+        self._starts = [0]
+        self._blocks = [_MemoBlock(0)]
+        self._size = 0
+
+    def _store(self, key, entry):
+        parser, pos = key
+        starts, blocks = self._starts, self._blocks
+        index = bisect.bisect_right(starts, pos) - 1
+        block = blocks[index]
+        if pos >= starts[index] + _MEMO_BLOCK and (not block.entries or block.top + block.delta < pos):
+            # Start a new block rather than growing this one
+            block = _MemoBlock(0)
+            starts.insert(index + 1, pos)
+            blocks.insert(index + 1, block)
+        stored = pos - block.delta
+        if (parser, stored) not in block.entries:
+            self._size += 1
+        block.entries[(parser, stored)] = entry
+        if stored > block.top:
+            block.top = stored
+        if stored + entry[3] > block.reach:
+            block.reach = stored + entry[3]
+        order = self._entries
+        order[block] = None
+        order.move_to_end(block)
+        while self.maxsize is not None and self._size > self.maxsize:
+            evicted = order.popitem(last=False)[0]
+            self._size -= len(evicted.entries)
+            evicted.entries.clear()
+
+    def edit(self, offset, deleted, inserted):
+        """Drop the outcomes that looked at an edit, and move those after it."""
+        end = offset + deleted
+        delta = inserted - deleted
+        starts, blocks = self._starts, self._blocks
+        first = bisect.bisect_right(starts, offset) - 1
+        last = bisect.bisect_right(starts, end) - 1
+        for block in blocks[:first]:
+            if block.entries and block.reach + block.delta > offset:
+                self._prune(block, lambda pos, reach: reach <= offset)
+        left = blocks[first]
+        if first == last:
+            right = _MemoBlock(left.delta)
+            for key, entry in list(left.entries.items()):
+                if key[1] + left.delta > end:
+                    right.entries[key] = left.entries.pop(key)
+            right.bound()
+            if right.entries:
+                self._entries[right] = None
+        else:
+            right = blocks[last]
+            self._prune(right, lambda pos, reach: pos > end)
+            for block in blocks[first + 1:last]:
+                self._size -= len(block.entries)
+                self._entries.pop(block, None)
+        self._prune(left, lambda pos, reach: pos < offset and reach <= offset)
+        for block in blocks[last + 1:]:
+            block.delta += delta
+        right.delta += delta
+        starts[first + 1:] = [offset + inserted] + [start + delta for start in starts[last + 1:]]
+        blocks[first + 1:] = [right] + blocks[last + 1:]
+        if starts[first] == starts[first + 1]:
+            del starts[first], blocks[first]
+            self._entries.pop(left, None)
+
+    def _prune(self, block, keep):
+        """Drop the outcomes in ``block`` for which ``keep(pos, reach)`` is false."""
+        entries = block.entries
+        for key, entry in list(entries.items()):
+            pos = key[1] + block.delta
+            if not keep(pos, pos + entry[3]):
+                del entries[key]
+                self._size -= 1
+        block.bound()
+
+    def __len__(self):
+        return self._size
+
+def _shifted(value, delta, shifted):
+    """Return a result or error with its recorded positions moved by ``delta``.
+
+    Results may already have been handed out, so they're copied rather than
+    changed; ``shifted`` maps the ids of those copied so far to their copies.
+    """
+    if value is None or isinstance(value, (str, bytes)):
+        return value
+    elif id(value) in shifted:
+        return shifted[id(value)][1]
+    if isinstance(value, Node):
+        children = _shifted(value.children, delta, shifted)
+        moved = Node(value.name, value.start + delta, value.end + delta, children, value.input)
+    elif isinstance(value, Match):
+        result = _shifted(value.result, delta, shifted)
+        if value.start is None:
+            moved = Match(result, value._matched) if result is not value.result else value
+        else:
+            moved = Match(result, value._matched, value.input, value.start + delta, value.end + delta)
+    elif isinstance(value, Partial):
+        result = _shifted(value.result, delta, shifted)
+        moved = Partial(result, value.remainder) if result is not value.result else value
+    elif isinstance(value, (list, tuple)):
+        items = [_shifted(item, delta, shifted) for item in value]
+        if all(item is original for item, original in zip(items, value)):
+            moved = value
+        else:
+            moved = items if isinstance(value, list) else type(value)(items)
+    elif isinstance(value, ParserError) and value.pos is not None:
+        moved = type(value).__new__(type(value), *value.args)
+        moved.__dict__.update(value.__dict__)
+        moved.pos += delta
+        if not value.args:
+            # Rendered from the old position, so render it again
+            moved._message = None
+    else:
+        moved = value
+    # Keep the original alive so its id can't be reused meanwhile
+    shifted[id(value)] = (value, moved)
+    return moved
+
+class IncrementalInput(Input):
+    """Editable input, reparsed incrementally after each edit.
+
+    >>> document = IncrementalInput(text)
+    >>> result = document.parse(grammar)
+    >>> document.edit(120, 4, 'new text')
+    >>> result = document.parse(grammar)
+
+    Every parser call is memoized along with how far into the input it
+    looked. An edit drops the outcomes that looked at the edited text and
+    moves those after it, so a reparse only redoes the parsers around the
+    edit and those enclosing it. Regular expressions of unbounded width that
+    match are assumed to look no further than ``lookahead`` characters past
+    where they stop; those that fail are taken to have looked as far as the
+    items they could match run on. None are assumed to look more than one
+    character behind the cursor.
+    """
+    __slots__ = ('reach', 'lookahead')
+
+    def __init__(self, value, tree=False, lookahead=1024, maxsize=None):
+        if not isinstance(value, (str, bytes)):
+            raise TypeError('IncrementalInput needs a str or bytes value')
+        self.reach = 0
+        self.lookahead = max(lookahead, 1)
+        super(IncrementalInput, self).__init__(value, memoize=_IncrementalMemo(maxsize), tree=tree)
+
+    def parse(self, parser):
+        """Parse the whole input, reusing what earlier parses found."""
+        self._start(self.buffer)
+        self.reach = 0
+        try:
+            return parser(self)
+        except ParserError as e:
+            raise self.furthest_error(e)
+
+    def edit(self, offset, deleted, inserted):
+        """Replace ``deleted`` items at ``offset`` with ``inserted``."""
+        if not 0 <= offset <= offset + deleted <= len(self.buffer):
+            raise IndexError('Edit outside of the input')
+        self.buffer = self.buffer[:offset] + inserted + self.buffer[offset + deleted:]
+        self.memo.edit(offset, deleted, len(inserted))
+        self._newlines = None
+
+    def _examine(self, end):
+        if end > self.reach:
+            self.reach = end
+
+    @property
+    def value(self):
+        self._examine(len(self.buffer) + 1)
+        return self.buffer[self.pos:]
+
+    def consume(self, chars):
+        self._examine(self.pos + chars)
+        return super(IncrementalInput, self).consume(chars)
+
+    def match(self, parser):
+        match = super(IncrementalInput, self).match(parser)
+        # The buffer changes with edits
+        match.matched
+        return match
+
+    def match_regex(self, regexp):
+        end = super(IncrementalInput, self).match_regex(regexp)
+        self._examine(self._regex_reach(regexp, self.pos, end))
+        return end
+
+    def find(self, value):
+        found = super(IncrementalInput, self).find(value)
+        self._examine(len(self.buffer) + 1 if found is None else found + len(value))
+        return found
+
+    def search_regex(self, regexp):
+        found = super(IncrementalInput, self).search_regex(regexp)
+        if found is None:
+            self._examine(len(self.buffer) + 1)
+        else:
+            self._examine(self._regex_reach(regexp, found, regexp.match(self.buffer, found).end()))
+        return found
+
+    def next_item(self):
+        self._examine(self.pos + 1)
+        return super(IncrementalInput, self).next_item()
+
+    def startswith(self, value):
+        self._examine(self.pos + len(value))
+        return super(IncrementalInput, self).startswith(value)
+
+    def __bool__(self):
+        self._examine(self.pos + 1)
+        return super(IncrementalInput, self).__bool__()
+
+    def __getitem__(self, offset):
+        if isinstance(offset, int) and offset >= 0:
+            self._examine(self.pos + offset + 1)
+        else:
+            self._examine(len(self.buffer) + 1)
+        return super(IncrementalInput, self).__getitem__(offset)
+
+    def __len__(self):
+        self._examine(len(self.buffer) + 1)
+        return super(IncrementalInput, self).__len__()
+
+    def _has(self, pos):
+        self._examine(pos + 1)
+        return super(IncrementalInput, self)._has(pos)
+
+    def _regex_reach(self, regexp, start, end):
+        """Return how far a regex matched (or not) at ``start`` looked."""
+        width, first = _regex_bounds(regexp)
+        if width is not None:
+            # One more for assertions such as '$' or '\b'
+            return start + width + 1
+        elif end is not None:
+            return end + self.lookahead
+        items, nullable = first
+        if items is not None and not nullable and self.buffer[start:start + 1] not in items:
+            return start + 1
+        # A failed attempt may have scanned any distance, but never past an
+        # item the regex has no way of matching
+        alphabet = _regex_alphabet(regexp)
+        if alphabet is None:
+            return len(self.buffer) + 1
+        return alphabet(self.buffer, start).end() + 1
+
+@functools.lru_cache(maxsize=1024)
+def _compile_regex(pattern, flags):
+    return re.compile(pattern, flags)
+
+@functools.lru_cache(maxsize=1024)
+def _regex_bounds(regexp):
+    """Return the maximum width of a regex (None if unbounded) and its first set."""
+    try:
+        parsed = _sre_parse.parse(regexp.pattern, regexp.flags)
+    except Exception:
+        return None, (None, True)
+    width = parsed.getwidth()[1]
+    if width >= _sre.MAXREPEAT or _looks_ahead(parsed.data):
+        width = None
+    return width, _regex_first(regexp)
+
+@functools.lru_cache(maxsize=1024)
+def _regex_alphabet(regexp):
+    """Return the match method of a regex for runs of items ``regexp`` may match.
+
+    Returns None if the items can't be worked out.
+    """
+    try:
+        parsed = _sre_parse.parse(regexp.pattern, regexp.flags)
+        atoms = []
+        if not _collect_atoms(parsed.data, atoms):
+            return None
+        state = getattr(parsed, 'state', None) or parsed.pattern
+        if not atoms:
+            return re.compile(regexp.pattern[:0]).match
+        branches = [_sre_parse.SubPattern(state, [atom]) for atom in atoms]
+        branch = _sre_parse.SubPattern(state, [(_sre.BRANCH, (None, branches))])
+        run = _sre_parse.SubPattern(state, [(_sre.MAX_REPEAT, (0, _sre.MAXREPEAT, branch))])
+        return _sre_compile.compile(run, state.flags).match
+    except Exception:
+        return None
+
+def _collect_atoms(data, atoms):
+    """Add the single-item elements of a parsed regex to ``atoms``.
+
+    Returns False for elements that aren't understood, such as groups
+    changing flags, whose items would be matched differently on their own.
+    """
+    for op, av in data:
+        if op in (_sre.LITERAL, _sre.NOT_LITERAL, _sre.IN, _sre.ANY):
+            atoms.append((op, av))
+        elif op is _sre.BRANCH:
+            if not all(_collect_atoms(branch, atoms) for branch in av[1]):
+                return False
+        elif op is _sre.SUBPATTERN:
+            group, add_flags, del_flags, pattern = av
+            if add_flags or del_flags or not _collect_atoms(pattern, atoms):
+                return False
+        elif op in _REPEATS:
+            if not _collect_atoms(av[2], atoms):
+                return False
+        elif op in (_sre.ASSERT, _sre.ASSERT_NOT):
+            if not _collect_atoms(av[1], atoms):
+                return False
+        elif op is getattr(_sre, 'ATOMIC_GROUP', None):
+            if not _collect_atoms(av, atoms):
+                return False
+        elif op is _sre.GROUPREF_EXISTS:
+            if not all(_collect_atoms(branch, atoms) for branch in av[1:] if branch is not None):
+                return False
+        elif op not in (_sre.AT, _sre.GROUPREF):
+            # Backreferences only match what a group did
+            return False
+    return True
+
+def _looks_ahead(data):
+    for item in data:
+        if isinstance(item, (tuple, list)):
+            if item and item[0] in (_sre.ASSERT, _sre.ASSERT_NOT) and item[1][0] == 1:
+                return True
+            if _looks_ahead(item):
+                return True
+        elif hasattr(item, 'data') and _looks_ahead(item.data):
+            return True
+    return False
+
 class QualifiedResult(object):
+    __slots__ = ()
     def __add__(self, other):
         return self.result + other
     
@@ -207,16 +1433,91 @@ class QualifiedResult(object):
         return other + self.result
     
 class Match(QualifiedResult):
-    def __init__(self, result, matched):
+    """Result of ``Input.match``, with the text it was parsed from.
+
+    The text may be given as ``matched``, or as a span of ``input`` from
+    ``start`` to ``end``, which is only sliced when first asked for.
+    """
+    __slots__ = ('result', '_matched', 'input', 'start', 'end')
+
+    def __init__(self, result, matched=None, input=None, start=None, end=None):
         self.result = result
-        self.matched = matched
+        self._matched = matched
+        self.input = input
+        self.start = start
+        self.end = end
+
+    @property
+    def matched(self):
+        if self._matched is None:
+            self._matched = self.input.slice(self.start, self.end)
+        return self._matched
+
+    def __reduce__(self):
+        # Leave the input behind
+        return Match, (self.result, self.matched)
     
 class Partial(QualifiedResult):
+    __slots__ = ('result', 'remainder')
+
     def __init__(self, result, remainder):
         self.result = result
         self.remainder = remainder
 
+    def __repr__(self):
+        return 'Partial({!r}, remainder={!r})'.format(self.result, self.remainder)
+
+class Node(object):
+    """Parse tree node for a named rule, as produced in tree mode.
+
+    Nodes only record the span they matched, as offsets into the input, and
+    the nodes of the named rules within it; ``text`` slices the input (on a
+    StreamInput, only while the span is still buffered).
+    """
+    __slots__ = ('name', 'start', 'end', 'children', 'input')
+
+    def __init__(self, name, start, end, children=(), input=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.children = children
+        self.input = input
+
+    @property
+    def text(self):
+        return self.input.slice(self.start, self.end)
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return ((self.name, self.start, self.end, self.children) ==
+                (other.name, other.start, other.end, other.children))
+
+    def __hash__(self):
+        return hash((self.name, self.start, self.end))
+
+    def __repr__(self):
+        return 'Node({!r}, {}, {}, {!r})'.format(self.name, self.start, self.end, self.children)
+
+class _Nodes(tuple):
+    """Sibling nodes collected from a combination of results."""
+    __slots__ = ()
+
+def _nodes(result):
+    """Return the nodes within a result, as a tuple."""
+    if isinstance(result, Node):
+        return (result,)
+    elif isinstance(result, _Nodes):
+        return result
+    elif isinstance(result, QualifiedResult):
+        return _nodes(result.result)
+    elif isinstance(result, (list, tuple)):
+        return _Nodes(node for item in result for node in _nodes(item))
+    else:
+        return ()
+
 class Nil(object):
+    __slots__ = ()
     def __add__(self, other):
         return other
     
@@ -250,35 +1551,183 @@ class Nil(object):
         return 'Nil'
 
 Nil = Nil()
+
+def _concat(results):
+    """Add up a list of results, in linear time for strings and bytes."""
+    parts = [result for result in results if result is not Nil]
+    if not parts:
+        return Nil
+    elif len(parts) == 1:
+        return parts[0]
+
+    kind = type(parts[0])
+    if kind in (str, bytes, bytearray) and all(type(part) is kind for part in parts):
+        return kind().join(parts)
+    elif kind is memoryview and all(isinstance(part, (bytes, memoryview)) for part in parts):
+        return b''.join(parts)
+    elif any(isinstance(part, (Node, _Nodes)) for part in parts):
+        # Tree mode: keep the nodes, the text is in their spans
+        return _Nodes(node for part in parts for node in _nodes(part))
+
+    parsed = parts[0]
+    if isinstance(parsed, list):
+        # The list may be cached (memoized, or by a rule), so extend a copy
+        parsed = list(parsed)
+    for part in parts[1:]:
+        parsed = _add(parsed, part)
+    return parsed
+
+def _add(parsed, result):
+    try:
+        parsed += result
+    except TypeError:
+        # memoryview slices can't be concatenated; join them as bytes
+        if not isinstance(parsed, memoryview) and not isinstance(result, memoryview):
+            raise
+        parsed = bytes(parsed) + bytes(result)
+    return parsed
         
 # Errors
-class ParserError(Exception): pass
+class ParserError(Exception):
+    """Parse failure.
+
+    Failures are routine while backtracking, so besides a plain message a
+    ParserError may just record the input, position and what was expected
+    there (a description, a parser or a list of either); the message is only
+    formatted when the error is displayed.
+    """
+    def __init__(self, message=None, expected=None, input=None, pos=None, parser=None):
+        if message is None:
+            super(ParserError, self).__init__()
+        else:
+            super(ParserError, self).__init__(message)
+        self._message = message
+        self.expected = expected
+        self.input = input
+        self.pos = pos
+        self.parser = parser
+
+    @property
+    def message(self):
+        if self._message is None:
+            self._message = self._render()
+        return self._message
+
+    @property
+    def line(self):
+        position = self._line_col()
+        return position and position[0]
+
+    @property
+    def column(self):
+        position = self._line_col()
+        return position and position[1]
+
+    def _line_col(self):
+        if self.input is None or self.pos is None:
+            return None
+        return self.input.line_col(self.pos)
+
+    def _render(self):
+        expected = _describe(self.parser if self.expected is None else self.expected)
+        if self.input is None:
+            return 'Expected {}'.format(expected)
+        excerpt = self.input.excerpt(self.pos)
+        if excerpt:
+            message = 'Expected {} but received {}'.format(expected, excerpt)
+        else:
+            message = 'Expected {} but encountered end of input'.format(expected)
+        position = self._line_col()
+        if position:
+            message += ' at line {}, column {}'.format(*position)
+        return message
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.message)
+
+    def __reduce__(self):
+        # The input stays behind, so render the message while it's there
+        return type(self), (self.message, None, None, self.pos)
+
 class EndOfInputError(ParserError): pass
 
-def mismatch(expected='', received=''):
-    if not received or received == repr(''):
+def mismatch(expected='', received='', input=None, parser=None):
+    if input is not None:
+        error = ParserError if input else EndOfInputError
+        input._failed(input.pos, expected or parser)
+        return error(expected=expected or None, input=input, pos=input.pos, parser=parser)
+    elif not received or received == repr(''):
         return EndOfInputError('Expected {} but encountered end of input'.format(expected))
     else:
         return ParserError('Expected {} but received {}'.format(expected, received))
+
+def _describe(expected):
+    if isinstance(expected, Parser):
+        return expected.describe()
+    elif isinstance(expected, (list, tuple, dict)):
+        descriptions = []
+        for item in expected:
+            description = _describe(item)
+            if description not in descriptions:
+                descriptions.append(description)
+        return ' or '.join(descriptions)
+    else:
+        return str(expected)
     
 # Decorators
 def parser(parse_func):
     class ParserWrapper(Parser):
+        __slots__ = ()
+
         def parse(self, input):
             return parse_func(input)
+
+        def __reduce__(self):
+            # Pickled by reference, as parse_func may not be picklable itself
+            name = (parse_func.__module__, parse_func.__qualname__)
+            try:
+                found = _lookup(*name) is self
+            except (AttributeError, ImportError):
+                found = False
+            if not found:
+                raise pickle.PicklingError('Cannot pickle parser {}: only module-level '
+                                           '@parser functions can be pickled'.format(
+                                               parse_func.__qualname__))
+            return _lookup, name
     ParserWrapper.__name__ = parse_func.__name__
     return ParserWrapper()
 
+def _lookup(module, qualname):
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
 # Basic parsers
 class constant(Parser):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
         
     def parse(self, input):
-        if input[0:len(self.value)] == self.value:
+        if input.startswith(self.value):
             return input.consume(len(self.value))
         else:
-            raise mismatch(expected=repr(self.value), received=repr(input))
+            raise mismatch(input=input, parser=self)
+
+    def describe(self):
+        return repr(self.value)
+
+    def _first(self, firsts):
+        if not isinstance(self.value, (str, bytes)):
+            return None, True
+        elif self.value:
+            return frozenset([self.value[0:1]]), False
+        else:
+            return frozenset(), True
 
     def __mul__(self, other):
         return constant(self.value * other)
@@ -287,22 +1736,53 @@ class constant(Parser):
         return constant(self.value * other)
 
 class regex(Parser):
+    """Regular expression, compiled when first used.
+
+    Compiled patterns are shared by every regex with the same pattern and
+    flags, so an invalid pattern only raises re.error once it's used.
+    """
+    __slots__ = ('_regexp', 'pattern', 'flags', 'desc')
     def __init__(self, pattern, flags=0, desc=''):
-        self.regexp = re.compile(pattern, flags)
+        if isinstance(pattern, re.Pattern):
+            self._regexp = re.compile(pattern, flags)
+            pattern, flags = self._regexp.pattern, self._regexp.flags
+        else:
+            self._regexp = None
+        self.pattern = pattern
+        self.flags = flags
         if desc:
             self.desc = desc
         else:
             self.desc = 'regular expression ' + repr(pattern)
 
+    @property
+    def regexp(self):
+        if self._regexp is None:
+            self._regexp = _compile_regex(self.pattern, self.flags)
+        return self._regexp
+
+    def __getstate__(self):
+        return self.pattern, self.flags, self.desc
+
+    def __setstate__(self, state):
+        self.pattern, self.flags, self.desc = state
+        self._regexp = None
+
+    def _first(self, firsts):
+        return _regex_first(self.regexp)
+
+    # Patterns are matched at the cursor position, so '^' only matches at the
+    # start of the whole input (or after a newline with re.MULTILINE).
     def parse(self, input):
-        matched = self.regexp.match(input.value)
-        if matched:
-            return input.consume(matched.end())
+        end = input.match_regex(self._regexp or self.regexp)
+        if end is not None:
+            return input.consume(end - input.pos)
         else:
-            raise mismatch(expected=self.desc, received=repr(input))
+            raise mismatch(input=input, parser=self)
 
 # Pre- and Post-Processing
 class Pipe(Parser):
+    __slots__ = ('in_fn', 'out_fn')
     def __init__(self, in_fn, out_fn):
         self.in_fn = in_fn
         self.out_fn = out_fn
@@ -313,6 +1793,19 @@ class Pipe(Parser):
     def parse(self, input):
         return self(input)
 
+    def _first(self, firsts):
+        if isinstance(self.in_fn, Parser):
+            return _first(self.in_fn, firsts)
+        return None, True
+
+    def _compile(self, compiler):
+        in_fn, out_fn = self.in_fn, self.out_fn
+        if isinstance(in_fn, Parser):
+            in_fn = compiler.compile(in_fn)
+        if isinstance(out_fn, Parser):
+            out_fn = compiler.compile(out_fn)
+        return Pipe(in_fn, out_fn)
+
     def __rshift__(self, other):
         return Pipe(self, other)
 
@@ -321,35 +1814,98 @@ class Pipe(Parser):
         
 # Combinators
 class ignored(UnaryCombinator):
+    __slots__ = ()
     def parse(self, input):
         self.parser(input)
         return Nil
 
+    def _compile(self, compiler):
+        parser = compiler.compile(self.parser)
+        # The result is discarded, so optional(x) can be a regex ending in '?'
+        if isinstance(parser, optional):
+            fused = _fuse(parser.parser, '?', parser.describe())
+            if fused is not None:
+                return ignored(fused)
+        return ignored(parser)
+
 class many(UnaryCombinator):
+    __slots__ = ('at_least',)
     def __init__(self, parser, at_least=0):
         self.at_least = at_least
         super(many, self).__init__(parser)
         
     def parse(self, input):
-        parsed = Nil
-        count = 0
+        parser = self.parser
+        start = input.pos
 
-        input.begin()        
-        while input:
+        # Only held until there are at_least occurrences, so that a
+        # StreamInput can let go of those parsed
+        input.begin()
+        held = True
+        if isinstance(parser, not_) and _skip_to(input, parser.parser):
+            # Every item up to the excluded parser is one occurrence
+            count = input.pos - start
+            parsed = input.slice(start, input.pos) if count else Nil
+            if input:
+                input._failed(input.pos, parser)
+        else:
+            parsed = []
+            checkpoint = input._checkpoints and input._checkpoints.pop((self, start), None)
+            if checkpoint:
+                parsed, input.pos = checkpoint
+            last = input.pos
             try:
-                parsed += self.parser(input)
-                count += 1
-            except ParserError:
-                break
+                while input:
+                    if held and len(parsed) >= self.at_least:
+                        input.commit()
+                        held = False
+                    try:
+                        parsed.append(parser(input))
+                    except ParserError:
+                        break
+                    last = input.pos
+            except _NeedData:
+                input._suspend(self, start, (parsed, last))
+                raise
+            count = len(parsed)
+            parsed = _concat(parsed)
 
         if count >= self.at_least:
-            input.commit()
+            if held:
+                input.commit()
             return parsed
         else:
             input.rollback()
-            raise mismatch(expected='at least {} occurrences of {}'.format(self.at_least, self.parser), received=input)
+            raise mismatch(input=input, parser=self)
+
+    def describe(self):
+        return 'at least {} occurrences of {}'.format(self.at_least, self.parser.describe())
+
+    def _first(self, firsts):
+        items, nullable = _first(self.parser, firsts)
+        return items, nullable or self.at_least == 0
+
+    def _compile(self, compiler):
+        parser = compiler.compile(self.parser)
+        # Beyond one occurrence, a regex could backtrack to reach at_least
+        if self.at_least <= 1:
+            fused = _fuse(parser, '*' if self.at_least == 0 else '+', self.describe(), _span)
+            if fused is not None:
+                return fused
+        return many(parser, at_least=self.at_least)
+
+class memoized(UnaryCombinator):
+    __slots__ = ()
+    def parse(self, input):
+        if input.packrat:
+            # Every call is already cached
+            return self.parser(input)
+        if input.memo is None:
+            input.memo = MemoTable()
+        return input.memo.apply(self.parser, input)
 
 class not_(UnaryCombinator):
+    __slots__ = ()
     def parse(self, input):
         input.begin()
         try:
@@ -359,11 +1915,57 @@ class not_(UnaryCombinator):
             return input.consume(1)
         else:
             input.rollback()
-            raise ParserError('Matched unwanted input: ' + input)
+            input._failed(input.pos, self)
+            raise ParserError(input=input, pos=input.pos, parser=self)
+
+    def describe(self):
+        return 'anything but ' + self.parser.describe()
+
+    def _first(self, firsts):
+        return None, False
         
 class one_of(MultaryCombinator):
+    __slots__ = ('_fused',)
+    def __init__(self, parsers):
+        # (parsers, fused alternatives, dispatch table), published as one
+        # so threads sharing the parser never see them out of step
+        self._fused = None
+        super(one_of, self).__init__(parsers)
+
+    def __getstate__(self):
+        # The fused alternatives and dispatch table are rebuilt on first use
+        return (self.parsers,)
+
+    def __setstate__(self, state):
+        self.parsers, = state
+        self._fused = None
+
     def parse(self, input):
-        for parser in self.parsers:
+        if not isinstance(input.buffer, _TEXT_BUFFERS):
+            # Fused regexes can't match other sequences, e.g. lists
+            alternatives = self.parsers
+        else:
+            fused = self._fused
+            if fused is None or fused[0] != self.parsers:
+                # Rebuilt whenever self.parsers has changed since
+                source = list(self.parsers)
+                alternatives = _fuse_alternatives(source)
+                fused = self._fused = (source, alternatives, _dispatch_table(alternatives))
+            source, alternatives, dispatch = fused
+            if dispatch is not None:
+                table, default = dispatch
+                try:
+                    alternatives = table.get(input.next_item(), default)
+                except TypeError: # unhashable, e.g. bytearray input
+                    pass
+        start = input.pos
+        first = 0
+        checkpoint = input._checkpoints and input._checkpoints.pop((self, start), None)
+        if checkpoint:
+            # The alternatives before it have already failed
+            first, = checkpoint
+            alternatives = alternatives[first:]
+        for index, parser in enumerate(alternatives, first):
             input.begin()
             try:
                 result = parser(input)
@@ -371,17 +1973,43 @@ class one_of(MultaryCombinator):
                 return result
             except ParserError:
                 input.rollback()
+            except _NeedData:
+                input._suspend(self, start, (index,))
+                raise
         else:
-            raise ParserError('None of the supplied parsers matched the provided input')
+            if input.furthest < input.pos or not alternatives:
+                # None of the alternatives recorded failing here
+                input._failed(input.pos, self)
+            # Report whatever got furthest, rather than just this position
+            raise ParserError(expected=dict(input._expected), input=input, pos=input.furthest)
+
+    def describe(self):
+        return _describe(self.parsers)
+
+    def _first(self, firsts):
+        items = set()
+        nullable = False
+        for parser in self.parsers:
+            parser_items, parser_nullable = _first(parser, firsts)
+            if parser_items is None:
+                return None, True
+            items |= parser_items
+            nullable = nullable or parser_nullable
+        return frozenset(items), nullable
 
 class optional(UnaryCombinator):
+    __slots__ = ()
     def parse(self, input):
         try:
             return self.parser(input)
         except ParserError:
             return Nil
 
+    def _first(self, firsts):
+        return _first(self.parser, firsts)[0], True
+
 class peek(UnaryCombinator):
+    __slots__ = ()
     def parse(self, input):
         input.begin()
         try:
@@ -392,46 +2020,285 @@ class peek(UnaryCombinator):
             input.rollback()
             raise
 
+# Left recursion support for rule, following Warth, Douglass and Millstein,
+# "Packrat Parsers Can Support Left Recursion" (2008)
+class _RuleState(object):
+    __slots__ = ('memo', 'heads', 'stack', 'open_heads')
+    def __init__(self):
+        self.memo = {}
+        self.heads = {}
+        self.stack = None
+        self.open_heads = 0
+
+class _RuleEntry(object):
+    __slots__ = ('answer', 'pos', 'reach')
+    def __init__(self, answer, pos):
+        self.answer = answer
+        self.pos = pos
+        self.reach = None
+
+class _LeftRecursion(object):
+    __slots__ = ('seed', 'rule', 'head', 'next')
+    def __init__(self, rule, next):
+        self.seed = None
+        self.rule = rule
+        self.head = None
+        self.next = next
+
+class _Head(object):
+    __slots__ = ('rule', 'involved', 'eval')
+    def __init__(self, rule):
+        self.rule = rule
+        self.involved = set()
+        self.eval = set()
+
+class rule(Parser):
+    """Forward-declarable parser which may refer to itself, even leftmost.
+
+    >>> expr = rule()
+    >>> expr.define(expr + '-' + digit | digit)
+
+    Rule outcomes are memoized per input; left-recursive rules grow their
+    result from a seed until it stops getting longer.
+    """
+    __slots__ = ('parser', 'name')
+    def __init__(self, parser=None, name=None):
+        self.parser = None if parser is None else self.coerce(parser)
+        self.name = name
+
+    def define(self, parser):
+        self.parser = self.coerce(parser)
+        return self
+
+    def describe(self):
+        return self.name or 'rule'
+
+    def _first(self, firsts):
+        if self.parser is None:
+            return None, True
+        return _first(self.parser, firsts)
+
+    def _compile(self, compiler):
+        compiled = rule(name=self.name)
+        compiler.define(self, compiled)
+        if self.parser is not None:
+            compiled.define(compiler.compile(self.parser))
+        return compiled
+
+    def parse(self, input):
+        if self.parser is None:
+            raise RuntimeError('Rule {} has not been defined'.format(self.name or ''))
+        state = input._rules
+        if state is None:
+            state = input._rules = _RuleState()
+        pos = input.pos
+        volatile = input.volatile
+        # Seed growing rewinds to pos, so keep it buffered on streams
+        input.begin()
+        try:
+            answer = self._apply(input, state, pos)
+        finally:
+            input.commit()
+
+        if not state.open_heads:
+            # Every seed grown below here is final again
+            input.volatile = volatile
+        if answer is None:
+            input.pos = pos
+            raise ParserError('Left recursion in rule {} has no base case'.format(self.name or ''))
+        result, error = answer
+        if error is not None:
+            raise error.with_traceback(None)
+        if input.tree and self.name:
+            return Node(self.name, pos, input.pos, _nodes(result), input)
+        return result
+
+    def _apply(self, input, state, pos):
+        entry = self._recall(input, state, pos)
+        if entry is None:
+            lr = _LeftRecursion(self, state.stack)
+            state.stack = lr
+            entry = _RuleEntry(lr, pos)
+            state.memo[(self, pos)] = entry
+            answer = self._eval(input)
+            state.stack = lr.next
+            entry.pos = input.pos
+            if lr.head is not None:
+                lr.seed = answer
+                answer = self._lr_answer(input, state, pos, entry)
+            else:
+                entry.answer = answer
+            entry.reach = input.reach
+        else:
+            input.pos = entry.pos
+            if entry.reach is not None:
+                input._examine(entry.reach)
+            answer = entry.answer
+            if isinstance(answer, _LeftRecursion):
+                self._setup_lr(state, answer)
+                input.volatile += 1
+                answer = answer.seed
+        return answer
+
+    def _eval(self, input):
+        start = input.pos
+        try:
+            return self.parser(input), None
+        except ParserError as e:
+            input.pos = start
+            return None, e
+
+    def _grow(self, input, state, pos, entry, head):
+        state.heads[pos] = head
+        while True:
+            input.pos = pos
+            head.eval = set(head.involved)
+            answer = self._eval(input)
+            if answer[1] is not None or input.pos <= entry.pos:
+                break
+            entry.answer = answer
+            entry.pos = input.pos
+        del state.heads[pos]
+        input.pos = entry.pos
+        return entry.answer
+
+    def _lr_answer(self, input, state, pos, entry):
+        lr = entry.answer
+        head = lr.head
+        if head.rule is not self:
+            input.volatile += 1
+            return lr.seed
+        entry.answer = answer = lr.seed
+        if answer is not None and answer[1] is None:
+            answer = self._grow(input, state, pos, entry, head)
+        state.open_heads -= 1
+        return answer
+
+    def _recall(self, input, state, pos):
+        entry = state.memo.get((self, pos))
+        head = state.heads.get(pos)
+        if head is None:
+            return entry
+        input.volatile += 1
+        if entry is None and self is not head.rule and self not in head.involved:
+            return _RuleEntry(None, pos)
+        if self in head.eval:
+            head.eval.discard(self)
+            if entry is None:
+                entry = state.memo[(self, pos)] = _RuleEntry(None, pos)
+            entry.answer = self._eval(input)
+            entry.pos = input.pos
+            entry.reach = input.reach
+        return entry
+
+    def _setup_lr(self, state, lr):
+        if lr.head is None:
+            lr.head = _Head(lr.rule)
+            state.open_heads += 1
+        s = state.stack
+        while s is not None and s.head is not lr.head:
+            s.head = lr.head
+            lr.head.involved.add(s.rule)
+            s = s.next
+
 # Consider merging with sequence. Add separator= keyword argument
 class sep_by(BinaryCombinator):
+    __slots__ = ()
     def parse(self, input):
         parser = self.parser1
         separator = self.parser2
+        start = input.pos
         parsed = []
+        checkpoint = input._checkpoints and input._checkpoints.pop((self, start), None)
+        if checkpoint:
+            parsed, input.pos = checkpoint
         
-        while input:
-            try:
-                input.begin()
-                if parsed:
-                    input.match(separator)
-                parsed.append(input.match(parser))
-            except ParserError:
-                input.rollback()
-                break
-            else:
-                input.commit()
+        last = input.pos
+        try:
+            while input:
+                try:
+                    input.begin()
+                    if parsed:
+                        separator(input)
+                    parsed.append(input.match(parser))
+                except ParserError:
+                    input.rollback()
+                    break
+                else:
+                    input.commit()
+                    last = input.pos
+        except _NeedData:
+            input._suspend(self, start, (parsed, last))
+            raise
 
+        if input.tree:
+            return _nodes(parsed)
         return parsed
 
+    def _first(self, firsts):
+        return _first(self.parser1, firsts)[0], True
+
 # Consider adding keyword arguments such as output_type, then use some kind of
 # monoid framework for construction
 class sequence(MultaryCombinator):
+    __slots__ = ('_iter_i',)
     def __init__(self, parsers):
         self._iter_i = 0
         super(sequence, self).__init__(parsers)
         
     def parse(self, input):
+        start = input.pos
         input.begin()
-        result = Nil
+        results = []
+        checkpoint = input._checkpoints and input._checkpoints.pop((self, start), None)
+        parsers = self.parsers
+        if checkpoint:
+            results, input.pos = checkpoint
+            parsers = parsers[len(results):]
+        last = input.pos
         try:
-            for parser in self.parsers:
-                result += parser(input)
+            for parser in parsers:
+                results.append(parser(input))
+                last = input.pos
         except ParserError:
             input.rollback()
             raise
+        except _NeedData:
+            input._suspend(self, start, (results, last))
+            raise
 
         input.commit()
-        return result
+        return _concat(results)
+
+    def _compile(self, compiler):
+        parsers = []
+        for parser in super(sequence, self)._compile(compiler).parsers:
+            previous = parsers[-1] if parsers else None
+            if _literal(parser) and _literal(previous) and type(parser.value) is type(previous.value):
+                pieces = previous.pieces if isinstance(previous, _joined) else [previous]
+                parsers[-1] = _joined(pieces + [parser])
+            else:
+                parsers.append(parser)
+        if len(parsers) == 1 and isinstance(parsers[0], (constant, regex)):
+            return parsers[0]
+        return sequence(parsers)
+
+    def describe(self):
+        # A sequence is expected where its first part is
+        if self.parsers:
+            return self.parsers[0].describe()
+        return super(sequence, self).describe()
+
+    def _first(self, firsts):
+        items = set()
+        for parser in self.parsers:
+            parser_items, nullable = _first(parser, firsts)
+            if parser_items is None:
+                return None, True
+            items |= parser_items
+            if not nullable:
+                return frozenset(items), False
+        return frozenset(items), True
 
     # Make sequences iterable
     def __iter__(self):
@@ -458,25 +2325,992 @@ class sequence(MultaryCombinator):
     def pop(self, *args, **kwargs):
         return self.parsers.pop(*args, **kwargs)
 
+def _skip_to(input, parser):
+    """Move to where ``parser`` next matches (or the end) by searching.
+
+    Returns False, without moving, if ``parser`` can't be searched for.
+    """
+    if type(parser) in (constant, _joined) and isinstance(parser.value, (str, bytes)):
+        end = input.find(parser.value)
+    elif type(parser) in (regex, _span):
+        end = input.search_regex(parser.regexp)
+    else:
+        return False
+    if end is None:
+        end = input.pos + len(input)
+    if end > input.pos:
+        # Where trying the parser at each position would have last failed
+        input._failed(end - 1, parser)
+        input.pos = end
+    return True
+
 # should this combinator fail if its operand is never encountered?
 class until(UnaryCombinator):
+    __slots__ = ()
     def parse(self, input):
-        parsed = Nil
-        while input:
-            try:
+        start = input.pos
+        # Keep the skipped span buffered, as the result is a slice of it
+        input.begin()
+        try:
+            searched = _skip_to(input, self.parser)
+            while not searched and input:
                 input.begin()
-                self.parser(input)
-                input.rollback()
-                return parsed
-            except EndOfInputError:
-                input.rollback()
-                raise
-            except ParserError:
-                input.rollback()
-                parsed += input.consume(1)
-        else:
-            return parsed
+                try:
+                    self.parser(input)
+                except EndOfInputError:
+                    input.rollback()
+                    raise
+                except ParserError:
+                    input.rollback()
+                    input.consume(1)
+                else:
+                    input.rollback()
+                    break
+            if input.pos == start:
+                return Nil
+            return input.slice(start, input.pos)
+        finally:
+            input.commit()
+
+    def _first(self, firsts):
+        return None, True
     
+# Grammar compilation
+class _Compiler(object):
+    __slots__ = ('compiled',)
+    def __init__(self):
+        self.compiled = {}
+
+    def compile(self, parser):
+        key = id(parser)
+        if key not in self.compiled:
+            # Keep the original alive so its id can't be reused meanwhile
+            self.compiled[key] = (parser, parser._compile(self))
+        return self.compiled[key][1]
+
+    def define(self, parser, compiled):
+        """Register ``compiled`` before its parts, for recursive grammars."""
+        self.compiled[id(parser)] = (parser, compiled)
+
+class _span(regex):
+    """Regular expression returning Nil rather than an empty match."""
+    __slots__ = ()
+    def parse(self, input):
+        end = input.match_regex(self._regexp or self.regexp)
+        if end is None:
+            raise mismatch(input=input, parser=self)
+        elif end == input.pos:
+            return Nil
+        else:
+            return input.consume(end - input.pos)
+
+class _joined(constant):
+    """Adjacent constants merged into one, failing as the sequence would."""
+    __slots__ = ('pieces',)
+    def __init__(self, pieces):
+        super(_joined, self).__init__(pieces[0].value[:0].join(p.value for p in pieces))
+        self.pieces = pieces
+
+    def parse(self, input):
+        if input.startswith(self.value):
+            return input.consume(len(self.value))
+        input.begin()
+        try:
+            for piece in self.pieces:
+                if not input.startswith(piece.value):
+                    raise mismatch(input=input, parser=piece)
+                input.consume(len(piece.value))
+        finally:
+            input.rollback()
+
+def _literal(parser):
+    return isinstance(parser, constant) and isinstance(parser.value, (str, bytes))
+
+def _pattern(parser):
+    if type(parser) is regex:
+        return parser.regexp.pattern, parser.regexp.flags
+    elif type(parser) is constant and isinstance(parser.value, (str, bytes)) and parser.value:
+        return re.escape(parser.value), 0
+    return None
+
+def _fuse(parser, quantifier, desc, cls=regex):
+    """Fold ``parser`` and a quantifier into one regex, if possible."""
+    pattern = _pattern(parser)
+    if pattern is None:
+        return None
+    source, flags = pattern
+    group = '(?:' if isinstance(source, str) else b'(?:'
+    end = ')' + quantifier if isinstance(source, str) else (')' + quantifier).encode()
+    fused = cls(group + source + end, flags, desc=desc)
+    try:
+        fused.regexp
+    except re.error:
+        return None
+    return fused
+
+def _fuse_alternatives(parsers):
+    """Merge runs of literal and regex alternatives into single regexes.
+
+    Python's regex alternation is ordered, like one_of, so the fused pattern
+    matches exactly what the first matching alternative would have.
+    """
+    alternatives = []
+    run = []
+    for parser in parsers + [None]:
+        pattern = _pattern(parser) if parser is not None else None
+        if pattern is not None and type(parser) is regex and parser.regexp.groups:
+            # Group numbers and names would clash once combined
+            pattern = None
+        if pattern is not None:
+            source, flags = pattern
+            flags = flags or re.compile(source[:0]).flags
+            if run and (type(source) is not type(run[0][1]) or flags != run[0][2]):
+                alternatives.extend(_alternation(run))
+                run = []
+            run.append((parser, source, flags))
+        else:
+            alternatives.extend(_alternation(run))
+            run = []
+            if parser is not None:
+                alternatives.append(parser)
+    return alternatives
+
+def _alternation(run):
+    parsers = [parser for parser, _, _ in run]
+    if len(run) < 2:
+        return parsers
+    source = run[0][1]
+    if isinstance(source, str):
+        pattern = '|'.join('(?:' + s + ')' for _, s, _ in run)
+    else:
+        pattern = b'|'.join(b'(?:' + s + b')' for _, s, _ in run)
+    fused = regex(pattern, run[0][2], desc=_describe(parsers))
+    try:
+        fused.regexp
+    except re.error:
+        return parsers
+    return [fused]
+
+# First sets
+def _first(parser, firsts):
+    """Memoized Parser._first, treating recursive references as unknown."""
+    if parser in firsts:
+        return firsts[parser] or (None, True)
+    firsts[parser] = None
+    firsts[parser] = result = parser._first(firsts)
+    return result
+
+def _dispatch_table(alternatives):
+    """Map each possible next item to the alternatives that may match it."""
+    firsts = {}
+    sets = [_first(parser, firsts) for parser in alternatives]
+    known = set()
+    for items, nullable in sets:
+        if items is not None:
+            known |= items
+    if not known:
+        return None
+    # Items outside every first set, and the end of input, get the rest
+    default = tuple(parser for parser, (items, nullable) in zip(alternatives, sets)
+                    if items is None or nullable)
+    table = {}
+    for item in known:
+        table[item] = tuple(parser for parser, (items, nullable) in zip(alternatives, sets)
+                            if items is None or nullable or item in items)
+    return table, default
+
+_REPEATS = tuple(op for op in (_sre.MAX_REPEAT, _sre.MIN_REPEAT,
+                               getattr(_sre, 'POSSESSIVE_REPEAT', None)) if op is not None)
+_MAX_RANGE = 256
+
+def _regex_first(regexp):
+    try:
+        parsed = _sre_parse.parse(regexp.pattern, regexp.flags)
+    except Exception:
+        return None, True
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return None, True
+    if isinstance(regexp.pattern, str):
+        item = chr
+    else:
+        item = lambda code: bytes((code,))
+    return _pattern_first(parsed, item)
+
+def _pattern_first(pattern, item):
+    items = set()
+    for op, av in pattern:
+        op_items, nullable = _opcode_first(op, av, item)
+        if op_items is None:
+            return None, True
+        items |= op_items
+        if not nullable:
+            return frozenset(items), False
+    return frozenset(items), True
+
+def _opcode_first(op, av, item):
+    if op is _sre.LITERAL:
+        return {item(av)}, False
+    elif op is _sre.IN:
+        items = set()
+        for in_op, in_av in av:
+            if in_op is _sre.LITERAL:
+                items.add(item(in_av))
+            elif in_op is _sre.RANGE and in_av[1] - in_av[0] < _MAX_RANGE:
+                items.update(item(code) for code in range(in_av[0], in_av[1] + 1))
+            else:
+                return None, True
+        return items, False
+    elif op is _sre.BRANCH:
+        items = set()
+        nullable = False
+        for branch in av[1]:
+            branch_items, branch_nullable = _pattern_first(branch, item)
+            if branch_items is None:
+                return None, True
+            items |= branch_items
+            nullable = nullable or branch_nullable
+        return items, nullable
+    elif op is _sre.SUBPATTERN:
+        group, add_flags, del_flags, pattern = av
+        if add_flags or del_flags:
+            return None, True
+        return _pattern_first(pattern, item)
+    elif op in _REPEATS:
+        minimum, maximum, pattern = av
+        items, nullable = _pattern_first(pattern, item)
+        return items, nullable or minimum == 0
+    elif op is getattr(_sre, 'ATOMIC_GROUP', None):
+        return _pattern_first(av, item)
+    elif op in (_sre.AT, _sre.ASSERT, _sre.ASSERT_NOT):
+        # Zero-width, so they add no items
+        return set(), True
+    else:
+        return None, True
+
+# Code generation
+# Bump when the generated code changes, so cached modules are not reused
+_GENERATOR_VERSION = 2
+
+def _cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'parsing')
+
+def _searchable(parser):
+    """Describe how _skip_to would search for ``parser``, or return None."""
+    if type(parser) in (constant, _joined) and isinstance(parser.value, (str, bytes)):
+        return ('find', parser.value)
+    elif type(parser) in (regex, _span):
+        return ('search', parser.regexp.pattern, parser.regexp.flags)
+    return None
+
+class _Generator(object):
+    """Translates a grammar into the source of a Python module.
+
+    Every parser is numbered and described by a spec, a tuple of its kind
+    and settings with its parts as numbers. The source only depends on the
+    specs, so their hash identifies it; the parser objects themselves, and
+    the functions of Pipes, are bound to the module as it is loaded.
+    """
+    __slots__ = ('parsers', 'specs', 'indices', 'firsts', 'types', 'calls')
+    def __init__(self, parser):
+        self.parsers = []
+        self.specs = []
+        self.indices = {}
+        self.firsts = {}
+        self.types = set()
+        # Parts of the parsers called as they are, which may call them anywhere
+        self.calls = {}
+        self.add(parser)
+        kinds = {}
+        for index, spec in enumerate(self.specs):
+            if spec[0] == 'rule':
+                kinds[index] = self._recursion(index)
+        for index, kind in kinds.items():
+            if kind == 'grow':
+                self.specs[index] = ('grow',) + self.specs[index][1:]
+            elif kind == 'call':
+                # Mutual left recursion needs the rule machinery
+                self.specs[index] = ('call',)
+        if len(self.types) > 1:
+            raise TypeError('Cannot generate code for a grammar mixing str and bytes')
+
+    def add(self, parser):
+        """Number ``parser`` and its parts, returning its number."""
+        index = self.indices.get(id(parser))
+        if index is None:
+            index = self.indices[id(parser)] = len(self.parsers)
+            self.parsers.append(parser)
+            self.specs.append(None)
+            self.specs[index] = self._spec(parser, index)
+        return index
+
+    def _spec(self, parser, index):
+        kind = type(parser)
+        if kind in (constant, _joined) and isinstance(parser.value, (str, bytes)):
+            self.types.add(type(parser.value))
+            return ('constant', parser.value, kind is _joined)
+        elif kind in (regex, _span):
+            self.types.add(type(parser.regexp.pattern))
+            return ('regex', parser.regexp.pattern, parser.regexp.flags, kind is _span)
+        elif kind is sequence:
+            return ('sequence', tuple(self.add(p) for p in parser.parsers))
+        elif kind is one_of:
+            alternatives = _fuse_alternatives(parser.parsers)
+            guards = []
+            for alternative in alternatives:
+                items, nullable = _first(alternative, self.firsts)
+                guards.append(None if items is None or nullable else tuple(sorted(items)))
+            return ('one_of', tuple(self.add(p) for p in alternatives), tuple(guards))
+        elif kind is many:
+            search = isinstance(parser.parser, not_) and _searchable(parser.parser.parser)
+            if search:
+                self.types.add(type(search[1]))
+                return ('skip', self.add(parser.parser), self.add(parser.parser.parser),
+                        parser.at_least, search)
+            return ('many', self.add(parser.parser), parser.at_least)
+        elif kind is until and _searchable(parser.parser):
+            search = _searchable(parser.parser)
+            self.types.add(type(search[1]))
+            return ('until', self.add(parser.parser), search)
+        elif kind in (optional, ignored, not_):
+            name = {optional: 'optional', ignored: 'ignored', not_: 'not'}[kind]
+            return (name, self.add(parser.parser))
+        elif kind is sep_by:
+            return ('sep_by', self.add(parser.parser1), self.add(parser.parser2))
+        elif kind is repeat:
+            return ('repeat', self.add(parser.parser), parser.times)
+        elif (kind is Pipe and isinstance(parser.in_fn, Parser) and
+              not isinstance(parser.out_fn, Parser)):
+            return ('pipe', self.add(parser.in_fn))
+        elif kind is rule and parser.parser is not None:
+            return ('rule', self.add(parser.parser))
+        parts = []
+        for name in ('parser', 'parser1', 'parser2', 'in_fn', 'out_fn'):
+            part = getattr(parser, name, None)
+            if isinstance(part, Parser):
+                parts.append(part)
+        if isinstance(parser, MultaryCombinator):
+            parts.extend(parser.parsers)
+        self.calls[index] = [self.add(part) for part in parts]
+        return ('call',)
+
+    def _nullable(self, index):
+        return _first(self.parsers[index], self.firsts)[1]
+
+    def _leftmost(self, index):
+        """Return the parts that ``index`` may call at its own position."""
+        spec = self.specs[index]
+        kind = spec[0]
+        if kind == 'sequence':
+            parts = []
+            for part in spec[1]:
+                parts.append(part)
+                if not self._nullable(part):
+                    break
+            return parts
+        elif kind == 'one_of':
+            return list(spec[1])
+        elif kind == 'sep_by':
+            return list(spec[1:]) if self._nullable(spec[1]) else [spec[1]]
+        elif kind == 'skip':
+            return [spec[2]]
+        elif kind in ('many', 'until', 'optional', 'ignored', 'not', 'repeat', 'pipe', 'rule',
+                      'grow'):
+            return [spec[1]]
+        return list(self.calls.get(index, ()))
+
+    def _left_reach(self, index):
+        """Return every part ``index`` may end up calling at its own position."""
+        reached = set()
+        stack = self._leftmost(index)
+        while stack:
+            part = stack.pop()
+            if part not in reached:
+                reached.add(part)
+                stack.extend(self._leftmost(part))
+        return reached
+
+    def _recursion(self, index):
+        """Classify rule ``index`` as 'rule', 'grow' if directly left-recursive, or 'call'."""
+        reached = self._left_reach(index)
+        if index not in reached:
+            return 'rule'
+        for part in reached:
+            # Recursion through another rule, or through a parser called as
+            # it is, would bypass the seed
+            if (part != index and (type(self.parsers[part]) is rule or part in self.calls) and
+                    index in self._left_reach(part)):
+                return 'call'
+        return 'grow'
+
+    def key(self):
+        spec = repr((_GENERATOR_VERSION, self.specs)).encode('utf-8')
+        return hashlib.sha256(spec).hexdigest()[:32]
+
+    def bindings(self):
+        """Return the objects the generated module refers to."""
+        names = {'Nil': Nil, 'Match': Match, 'ParserError': ParserError, '_concat': _concat}
+        for index, parser in enumerate(self.parsers):
+            names['_x{}'.format(index)] = parser
+            if self.specs[index][0] == 'pipe':
+                names['_f{}'.format(index)] = parser.out_fn
+        return names
+
+    def load(self, cache):
+        name = 'parsing_' + self.key()
+        if cache:
+            directory = _cache_dir() if cache is True else os.fspath(cache)
+            path = os.path.join(directory, name + '.py')
+            if not os.path.exists(path):
+                os.makedirs(directory, exist_ok=True)
+                # Written aside first, so no one loads a partial module
+                temporary = '{}.{}.tmp'.format(path, os.getpid())
+                with open(temporary, 'w', encoding='utf-8') as file:
+                    file.write(self.source())
+                os.replace(temporary, path)
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            module.__dict__.update(self.bindings())
+            spec.loader.exec_module(module)
+            namespace = module.__dict__
+        else:
+            path = None
+            namespace = self.bindings()
+            exec(compile(self.source(), '<{}>'.format(name), 'exec'), namespace)
+        return _Generated(self.parsers[0], self.types or {str, bytes}, namespace['_g0'],
+                          cache, path)
+
+    def source(self):
+        lines = ['# Generated by parsing.Parser.generate from a grammar; do not edit',
+                 'import re', '']
+        for index, spec in enumerate(self.specs):
+            if spec[0] == 'regex':
+                lines.append('_r{} = re.compile({!r}, {}).match'.format(index, spec[1], spec[2]))
+            elif spec[0] in ('skip', 'until') and spec[-1][0] == 'search':
+                _, pattern, flags = spec[-1]
+                lines.append('_q{} = re.compile({!r}, {}).search'.format(index, pattern, flags))
+            elif spec[0] == 'one_of':
+                for k, guard in enumerate(spec[2]):
+                    if guard is not None:
+                        lines.append('_s{}_{} = frozenset({!r})'.format(index, k, guard))
+                if spec[2] and None not in spec[2]:
+                    items = sorted(set(item for guard in spec[2] for item in guard))
+                    lines.append('_s{} = frozenset({!r})'.format(index, items))
+        for index, spec in enumerate(self.specs):
+            lines.append('')
+            lines.append('def _g{}(buf, pos, inp, memo):'.format(index))
+            body = getattr(self, '_emit_' + spec[0])(index, *spec[1:])
+            lines.extend('    ' + line for line in body)
+        lines.append('')
+        return '\n'.join(lines)
+
+    # Each probe is the code trying part ``index`` at ``pos``: some lines to
+    # run first, a test for success, lines setting the result and end
+    # position on success, and lines recording the failure otherwise.
+    def _probe(self, index, result='r', end='q', keep=True):
+        spec = self.specs[index]
+        kind = spec[0]
+        if kind == 'ignored':
+            return self._probe(spec[1], result, end, keep=False)
+        elif kind == 'constant':
+            value = spec[1]
+            success = ['{} = {}'.format(result, repr(value) if keep else 'Nil'),
+                       '{} = pos + {}'.format(end, len(value))]
+            if spec[2]:
+                # Merged constants fail where the first differing one does
+                failure = ['inp.pos = pos', 'try:', '    _x{}.parse(inp)'.format(index),
+                           'except ParserError:', '    pass']
+            else:
+                failure = ['inp._failed(pos, _x{})'.format(index)]
+            return [], 'buf.startswith({!r}, pos)'.format(value), success, failure
+        elif kind == 'regex':
+            if not keep:
+                value = 'Nil'
+            elif spec[3]:
+                value = 'buf[pos:e] if e != pos else Nil'
+            else:
+                value = 'buf[pos:e]'
+            success = ['e = m.end()', '{} = {}'.format(result, value), '{} = e'.format(end)]
+            return (['m = _r{}(buf, pos)'.format(index)], 'm is not None', success,
+                    ['inp._failed(pos, _x{})'.format(index)])
+        else:
+            if keep:
+                success = ['{}, {} = t'.format(result, end)]
+            else:
+                success = ['{} = Nil'.format(result), '{} = t[1]'.format(end)]
+            return ['t = _g{}(buf, pos, inp, memo)'.format(index)], 't is not None', success, []
+
+    def _attempt(self, index, failed, result='r', end='q', keep=True):
+        """Lines trying ``index``, running ``failed`` if it doesn't match."""
+        before, test, success, failure = self._probe(index, result, end, keep)
+        return (before + ['if not ({}):'.format(test)] +
+                ['    ' + line for line in failure + failed] + success)
+
+    def _emit_constant(self, index, *_):
+        before, test, success, failure = self._probe(index)
+        return (before + ['if {}:'.format(test)] +
+                ['    ' + line for line in success + ['return r, q']] +
+                failure + ['return None'])
+
+    _emit_regex = _emit_constant
+
+    def _emit_sequence(self, index, parts):
+        lines = []
+        results = []
+        for k, part in enumerate(parts):
+            keep = self.specs[part][0] != 'ignored'
+            if keep:
+                results.append('r{}'.format(k))
+            lines.extend(self._attempt(part, ['return None'], 'r{}'.format(k), 'pos', keep))
+        if not results:
+            lines.append('return Nil, pos')
+        elif len(results) == 1:
+            lines.append('return {}, pos'.format(results[0]))
+        else:
+            lines.append('return _concat([{}]), pos'.format(', '.join(results)))
+        return lines
+
+    def _emit_one_of(self, index, alternatives, guards):
+        lines = []
+        if any(guard is not None for guard in guards):
+            lines.append('c = buf[pos:pos + 1]')
+        for k, (alternative, guard) in enumerate(zip(alternatives, guards)):
+            before, test, success, failure = self._probe(alternative)
+            block = (before + ['if {}:'.format(test)] +
+                     ['    ' + line for line in success + ['return r, q']] + failure)
+            if guard is not None:
+                # Only tried when the next item may start it, as in one_of
+                block = ['if c in _s{}_{}:'.format(index, k)] + ['    ' + line for line in block]
+            lines.extend(block)
+        if guards and None not in guards:
+            # No alternative was tried, so record the failure here
+            lines.extend(['if c not in _s{}:'.format(index),
+                          '    inp._failed(pos, _x{})'.format(index)])
+        lines.append('return None')
+        return lines
+
+    def _emit_optional(self, index, part):
+        before, test, success, failure = self._probe(part)
+        return (before + ['if {}:'.format(test)] +
+                ['    ' + line for line in success + ['return r, q']] +
+                failure + ['return Nil, pos'])
+
+    def _emit_ignored(self, index, part):
+        return self._attempt(part, ['return None'], keep=False) + ['return Nil, q']
+
+    def _emit_not(self, index, part):
+        before, test, success, failure = self._probe(part, keep=False)
+        return (before + ['if {}:'.format(test),
+                          '    inp._failed(pos, _x{})'.format(index),
+                          '    return None'] + failure +
+                ['if pos < len(buf):', '    return buf[pos:pos + 1], pos + 1', 'return None'])
+
+    def _emit_many(self, index, part, at_least):
+        lines = ['n = len(buf)', 'start = pos', 'results = []', 'while pos < n:']
+        lines.extend('    ' + line for line in self._attempt(part, ['break']))
+        lines.extend(['    results.append(r)', '    pos = q'])
+        if at_least:
+            lines.extend(['if len(results) < {}:'.format(at_least),
+                          '    inp._failed(start, _x{})'.format(index),
+                          '    return None'])
+        lines.append('return _concat(results), pos')
+        return lines
+
+    def _find(self, index, search):
+        if search[0] == 'find':
+            return ['e = buf.find({!r}, pos)'.format(search[1]),
+                    'if e < 0:', '    e = len(buf)']
+        return ['m = _q{}(buf, pos)'.format(index), 'e = len(buf) if m is None else m.start()']
+
+    def _emit_skip(self, index, excluded, target, at_least, search):
+        # As many(not_(x)) does: every item up to the next x is an occurrence
+        lines = self._find(index, search)
+        lines.extend(['if e > pos:', '    inp._failed(e - 1, _x{})'.format(target),
+                      'if e < len(buf):', '    inp._failed(e, _x{})'.format(excluded)])
+        if at_least:
+            lines.extend(['if e - pos < {}:'.format(at_least),
+                          '    inp._failed(pos, _x{})'.format(index),
+                          '    return None'])
+        lines.append('return (buf[pos:e] if e > pos else Nil), e')
+        return lines
+
+    def _emit_until(self, index, target, search):
+        lines = self._find(index, search)
+        lines.extend(['if e > pos:', '    inp._failed(e - 1, _x{})'.format(target),
+                      'return (buf[pos:e] if e > pos else Nil), e'])
+        return lines
+
+    def _emit_sep_by(self, index, item, separator):
+        lines = ['n = len(buf)', 'parsed = []', 'while pos < n:', '    back = pos',
+                 '    if parsed:']
+        lines.extend('        ' + line for line in
+                     self._attempt(separator, ['break'], 'r', 'pos', keep=False))
+        lines.extend('    ' + line for line in self._attempt(item, ['pos = back', 'break']))
+        lines.extend(['    parsed.append(Match(r, None, inp, pos, q))', '    pos = q',
+                      'return parsed, pos'])
+        return lines
+
+    def _emit_repeat(self, index, part, times):
+        lines = ['results = []', 'for _ in range({}):'.format(times)]
+        lines.extend('    ' + line for line in self._attempt(part, ['return None']))
+        lines.extend(['    results.append(r)', '    pos = q', 'return _concat(results), pos'])
+        return lines
+
+    def _emit_pipe(self, index, part):
+        lines = self._attempt(part, ['return None'])
+        lines.extend(['try:', '    r = _f{}(r)'.format(index), 'except ParserError:',
+                      '    return None', 'return r, q'])
+        return lines
+
+    def _emit_rule(self, index, part):
+        # Rule outcomes are memoized for the whole parse, as rule does
+        return ['key = ({}, pos)'.format(index), 'if key in memo:', '    return memo[key]',
+                't = memo[key] = _g{}(buf, pos, inp, memo)'.format(part), 'return t']
+
+    def _emit_grow(self, index, part):
+        # Left recursion fails at first, then the seed found without it is
+        # grown until it stops getting longer, as in rule
+        return ['key = ({}, pos)'.format(index),
+                'if key in memo:',
+                '    t = memo[key]',
+                '    if t is False:',
+                '        memo[key] = None',
+                '    return t or None',
+                'memo[key] = False',
+                't = _g{}(buf, pos, inp, memo)'.format(part),
+                'if memo[key] is None and t is not None:',
+                '    while True:',
+                '        memo[key] = t',
+                '        grown = _g{}(buf, pos, inp, memo)'.format(part),
+                '        if grown is None or grown[1] <= t[1]:',
+                '            break',
+                '        t = grown',
+                'memo[key] = t',
+                'return t']
+
+    def _emit_call(self, index):
+        return ['inp.pos = pos', 'try:', '    r = _x{}(inp)'.format(index),
+                'except ParserError:', '    return None', 'return r, inp.pos']
+
+class _Generated(Parser):
+    """Parser running the code generated for ``parser`` by Parser.generate."""
+    __slots__ = ('parser', 'types', 'entry', 'cache', 'path')
+    def __init__(self, parser, types, entry, cache, path):
+        self.parser = parser
+        self.types = frozenset(types)
+        self.entry = entry
+        self.cache = cache
+        self.path = path
+
+    def parse(self, input):
+        if (type(input) is not Input or input.packrat or input.tree or
+                type(input.buffer) not in self.types):
+            return self.parser(input)
+        start = input.pos
+        outcome = self.entry(input.buffer, start, input, {})
+        if outcome is None:
+            # Parsers called as they are may have moved it
+            input.pos = start
+            if input.furthest >= start:
+                raise input.furthest_error()
+            raise mismatch(input=input, parser=self.parser)
+        result, input.pos = outcome
+        return result
+
+    def describe(self):
+        return self.parser.describe()
+
+    def _first(self, firsts):
+        return _first(self.parser, firsts)
+
+    def __reduce__(self):
+        # The generated functions can't be pickled, so generate them again
+        return _load_generated, (self.parser, self.cache)
+
+def _load_generated(parser, cache):
+    return _Generator(parser).load(cache)
+
+# Profiling
+class ParserStats(object):
+    """Counters for one parser, as collected by Profiler."""
+    __slots__ = ('parser', 'calls', 'successes', 'failures', 'backtracks', 'consumed',
+                 'time', '_depth')
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.backtracks = 0
+        self.consumed = 0
+        self.time = 0.0
+        self._depth = 0
+
+    @property
+    def name(self):
+        return self.parser.describe()
+
+    def __repr__(self):
+        return '<ParserStats {}: {} calls, {:.6f}s>'.format(self.name, self.calls, self.time)
+
+class Profiler(object):
+    """Collect per-parser statistics for the parsing done within a with block.
+
+    >>> with Profiler() as profiler:
+    ...     my_parser(text)
+    >>> print(profiler.report())
+
+    For each parser called on an Input, this counts calls, successes and
+    failures, backtracks (rollbacks made while it was the innermost parser
+    running), the items consumed by its successful calls and the time spent
+    in it, counting recursive calls once. The __call__ methods of Parser and
+    Pipe and Input.rollback are only replaced while profiling, so there is no
+    cost otherwise. Profiling is not thread-safe.
+    """
+    def __init__(self):
+        self.stats = {}
+        self._active = []
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = (Parser.__call__, Pipe.__call__, Input.rollback)
+        parser_call, pipe_call, rollback = self._saved
+        stats, active = self.stats, self._active
+        clock = time.perf_counter
+
+        def profiled(call):
+            def profiled_call(parser, input, *args, **kwargs):
+                if not isinstance(input, Input):
+                    return call(parser, input, *args, **kwargs)
+                entry = stats.get(parser)
+                if entry is None:
+                    entry = stats[parser] = ParserStats(parser)
+                entry.calls += 1
+                entry._depth += 1
+                active.append(entry)
+                start = input.pos
+                began = clock()
+                try:
+                    result = call(parser, input, *args, **kwargs)
+                except ParserError:
+                    entry.failures += 1
+                    raise
+                else:
+                    entry.successes += 1
+                    entry.consumed += input.pos - start
+                    return result
+                finally:
+                    active.pop()
+                    entry._depth -= 1
+                    if not entry._depth:
+                        entry.time += clock() - began
+            return profiled_call
+
+        def profiled_rollback(input):
+            if active:
+                active[-1].backtracks += 1
+            rollback(input)
+
+        # Pipe overrides __call__, so it's replaced separately
+        Parser.__call__ = profiled(parser_call)
+        Pipe.__call__ = profiled(pipe_call)
+        Input.rollback = profiled_rollback
+        return self
+
+    def __exit__(self, *exc_info):
+        Parser.__call__, Pipe.__call__, Input.rollback = self._saved
+        self._saved = None
+        return False
+
+    def results(self, sort='time'):
+        """Return the collected ParserStats, largest ``sort`` attribute first."""
+        return sorted(self.stats.values(), key=lambda entry: getattr(entry, sort), reverse=True)
+
+    def report(self, sort='time', limit=20):
+        """Format the statistics as a table, one parser per line."""
+        lines = ['{:>9} {:>9} {:>9} {:>10} {:>10} {:>10}  {}'.format(
+            'calls', 'ok', 'failed', 'backtracks', 'consumed', 'seconds', 'parser')]
+        for entry in self.results(sort)[:limit]:
+            name = entry.name
+            if len(name) > 60:
+                name = name[:57] + '...'
+            lines.append('{:>9} {:>9} {:>9} {:>10} {:>10} {:>10.6f}  {}'.format(
+                entry.calls, entry.successes, entry.failures, entry.backtracks,
+                entry.consumed, entry.time, name))
+        return '\n'.join(lines)
+
+# Parallel parsing
+def _batches(values, size):
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _parse_batch(parser, values, errors, memoize):
+    return list(parser.parse_many(values, errors, memoize))
+
+def parse_parallel(parser, source, boundary=None, workers=None, chunk_size=1 << 20):
+    """Parse independent records in a pool of processes, yielding the results.
+
+    ``source`` (a string, bytes, mmap or file) is cut into parts of about
+    ``chunk_size`` at occurrences of ``boundary``, a constant or regex that
+    separates (or terminates) records and never occurs within one, a newline
+    by default. Each part is parsed record by record in a worker process and
+    the results are yielded in input order as they become available. Files
+    are mapped into memory rather than read when possible.
+
+    ``parser`` must be picklable: parsers built from this module's classes
+    and module-level @parser functions are. Otherwise, pass a module-level
+    function returning the parser instead, to build it in each worker.
+    Parse errors are raised with positions relative to the whole source.
+    """
+    buffer = _parallel_buffer(source)
+    if boundary is None:
+        boundary = '\n' if isinstance(buffer, str) else b'\n'
+    boundary = Parser.coerce(boundary)
+    workers = workers or os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_start_worker, initargs=(parser, boundary))
+    pending = collections.deque()
+    try:
+        for start, end in _split(buffer, boundary, chunk_size):
+            part = buffer[start:end]
+            if isinstance(part, memoryview):
+                part = part.tobytes()
+            pending.append((start, executor.submit(_parse_part, part)))
+            # Bound the parts held in memory at once
+            if len(pending) >= 2 * workers:
+                yield from _part_results(buffer, *pending.popleft())
+        while pending:
+            yield from _part_results(buffer, *pending.popleft())
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if buffer is not source and isinstance(buffer, mmap.mmap):
+            # Mapped here from a file, so not needed past this point
+            buffer.close()
+
+def _parallel_buffer(source):
+    if isinstance(source, (collections.abc.Sequence, mmap.mmap)):
+        return source
+    elif isinstance(source, io.TextIOBase):
+        return source.read()
+    elif hasattr(source, 'read'):
+        try:
+            return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # Not a regular file, or an empty one
+            return source.read()
+    return source
+
+def _split(buffer, boundary, chunk_size):
+    """Yield the (start, end) spans of parts, cut after a boundary."""
+    input = Input(buffer)
+    start = 0
+    while start < len(buffer):
+        input.pos = min(start + chunk_size, len(buffer))
+        if not _skip_to(input, boundary):
+            raise TypeError('Boundary must be a constant or regular expression')
+        if not input:
+            break
+        boundary(input)
+        yield start, input.pos
+        start = input.pos
+    if start < len(buffer):
+        yield start, len(buffer)
+
+_worker = None
+
+def _start_worker(parser, boundary):
+    global _worker
+    if not isinstance(parser, Parser):
+        parser = parser()
+    _worker = (parser, boundary)
+
+def _parse_part(part):
+    parser, boundary = _worker
+    input = Input(part)
+    results = []
+    try:
+        while input:
+            start = input.pos
+            results.append(parser(input))
+            if input:
+                boundary(input)
+            if input.pos == start:
+                raise ParserError('Parser made no progress at position {}'.format(start))
+    except ParserError as e:
+        if e.pos is None:
+            return False, (type(e), e.message, None)
+        e = input.furthest_error(e)
+        return False, (type(e), _describe(e.parser if e.expected is None else e.expected), e.pos)
+    return True, results
+
+def _part_results(buffer, start, future):
+    succeeded, value = future.result()
+    if succeeded:
+        return value
+    cls, message, pos = value
+    if pos is None:
+        raise cls('{} (in the part starting at position {})'.format(message, start))
+    error = cls(expected=message, input=Input(buffer), pos=start + pos)
+    # Render now, in case the buffer is closed later
+    error.message
+    raise error
+
+# Saving grammars
+_GRAMMAR_FORMAT = 'parsing grammar 1'
+
+def dump_grammar(parser, target):
+    """Save ``parser`` to ``target``, a path or binary file, for load_grammar.
+
+    The grammar is pickled with the sources of its regular expressions, so
+    it may only contain this module's parsers, module-level @parser
+    functions and, for ``>>``, picklable functions.
+    """
+    data = pickle.dumps((_GRAMMAR_FORMAT, parser), pickle.HIGHEST_PROTOCOL)
+    if hasattr(target, 'write'):
+        target.write(data)
+        return
+    # Written aside first, so no one loads a partial grammar
+    temporary = '{}.{}.tmp'.format(os.fspath(target), os.getpid())
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, target)
+
+def load_grammar(source, build=None):
+    """Return the grammar saved by dump_grammar in ``source``, a path or binary file.
+
+    Regular expressions are only compiled when first used. If ``source`` is
+    a path that doesn't exist yet, ``build`` is called to make the grammar,
+    which is saved there for next time.
+
+    Grammars are unpickled, which can run arbitrary code, so only load files
+    you trust as much as your own code. The format marker is checked after
+    unpickling; it catches files saved by something else, not tampering.
+    """
+    if hasattr(source, 'read'):
+        data = source.read()
+    elif build is not None and not os.path.exists(source):
+        parser = build()
+        dump_grammar(parser, source)
+        return parser
+    else:
+        with open(source, 'rb') as file:
+            data = file.read()
+    # Unpickling a malicious file runs its code before any check can happen
+    try:
+        loaded = pickle.loads(data)
+    except (pickle.UnpicklingError, EOFError):
+        loaded = None
+    if not (isinstance(loaded, tuple) and len(loaded) == 2 and loaded[0] == _GRAMMAR_FORMAT):
+        raise ValueError('{!r} is not a grammar saved by dump_grammar'.format(source))
+    return loaded[1]
+
 # Complimentary instances
 char = regex('.', desc='character')
 digit = regex('[0-9]', desc='digit')
@@ -485,12 +3319,44 @@ letter = regex('[A-Za-z]', desc='letter')
 whitespace = regex('[\s\t]+', desc='whitespace')
 word_boundary = regex('[\s\.,;\'\"!\?\(\)]+', desc='word boundary')
 
-def escaped(c):
-    @parser
-    def escaped_char(input):
+def _shared(factory):
+    """Memoize a parser factory, so calls with the same argument share a parser."""
+    cached = functools.lru_cache(maxsize=1024, typed=True)(factory)
+
+    @functools.wraps(factory)
+    def shared(arg):
+        try:
+            hash(arg)
+        except TypeError:
+            return factory(arg)
+        return cached(arg)
+    return shared
+
+class _escaped(Parser):
+    __slots__ = ('char',)
+
+    def __init__(self, c):
+        self.char = c
+
+    def parse(self, input):
         input.match('\\')
-        return input.match(c)
-    return escaped_char
+        return input.match(self.char)
+
+    def describe(self):
+        return 'escaped ' + Parser.coerce(self.char).describe()
 
+@_shared
+def escaped(c):
+    """A backslash followed by ``c``, returning the Match of ``c``."""
+    return _escaped(c)
+
+class _trimmed(sequence):
+    __slots__ = ()
+
+@_shared
 def trimmed(parser):
-    return Parser.coerce(parser).surrounded_by(ignored(optional(whitespace)))
+    """``parser`` with optional whitespace around it."""
+    parser = Parser.coerce(parser)
+    return _trimmed([_optional_whitespace, parser, _optional_whitespace])
+
+_optional_whitespace = ignored(optional(whitespace))
@@ -1,5 +1,6 @@
 import pytest
 import re
+import time
 from random import randint
 
 from parsing import *
@@ -245,3 +246,997 @@ def test_input_match_vs_parser_call():
     pattern = random_str()
     parser = constant(pattern)
     assert(parser(Input(pattern)) == Input(pattern).match(parser))
+
+# Test Input cursor behavior
+def test_input_cursor_does_not_copy_buffer():
+    text = 'foobarbaz'
+    input = Input(text)
+    assert(constant('foo')(input) == 'foo')
+    assert(input.buffer is text)
+    assert(input.pos == 3)
+    assert(input.value == 'barbaz')
+
+def test_input_rollback_restores_position():
+    input = Input('foobar')
+    input.begin()
+    input.consume(4)
+    input.rollback()
+    assert(input.pos == 0)
+    assert(input == 'foobar')
+
+def test_regex_matches_at_cursor():
+    input = Input('abc123')
+    letters = regex('[a-z]+')
+    digits = regex('[0-9]+')
+    assert(letters(input) == 'abc')
+    assert(digits(input) == '123')
+    assert(not input)
+
+def test_input_match_at_cursor():
+    input = Input('foobar')
+    constant('foo')(input)
+    matched = input.match('bar')
+    assert(matched.matched == 'bar')
+
+# Test packrat memoization
+def test_packrat_results_unchanged():
+    p = one_of([constant('foo') + 'x', constant('foo') + 'y'])
+    assert(p('fooy', memoize=True) == p('fooy'))
+
+def test_packrat_results_not_extended():
+    items = sep_by(digit, ',')
+    p = peek(items + ';') + items
+    assert(p('1,2;', memoize=True) == ['1', '2'])
+    item = sep_by(letter, ',')
+    p = one_of([sequence([item + 'y', 'z']), item + 'y'])
+    assert(p('a,by', memoize=True) == ['a', 'b', 'y'])
+
+def test_packrat_counts_hits():
+    foo = constant('foo')
+    p = one_of([foo + 'x', foo + 'y'])
+    input = Input('fooy', memoize=True)
+    assert(p(input) == 'fooy')
+    assert(input.memo.hits == 1)
+    assert(input.memo.misses > 0)
+
+def test_packrat_caches_failures():
+    bar = constant('bar')
+    p = optional(bar) + optional(bar) + 'foo'
+    input = Input('foo', memoize=True)
+    assert(p(input) == 'foo')
+    assert(input.memo.hits == 1)
+
+def test_memo_table_bounded():
+    table = MemoTable(maxsize=2)
+    p = many(regex('[a-z]'))
+    assert(p(Input('abcdef', memoize=table)) == 'abcdef')
+    assert(len(table) == 2)
+
+def test_memoized_combinator():
+    letters = memoized(regex('[a-z]+'))
+    p = one_of([letters + '1', letters + '2'])
+    input = Input('abc2')
+    assert(p(input) == 'abc2')
+    assert(input.memo.hits == 1)
+    assert(not input.packrat)
+
+# Test rules and left recursion
+number = regex('[0-9]+') >> int
+
+def test_rule_forward_declaration():
+    item = rule()
+    items = sep_by(item, ',')
+    item.define(regex('[a-z]+'))
+    assert(items('a,b,c') == ['a', 'b', 'c'])
+
+def test_rule_direct_left_recursion():
+    expr = rule()
+    expr.define(expr + '-' + digit | digit)
+    assert(expr('1-2-3') == '1-2-3')
+
+def test_rule_left_associative():
+    expr = rule()
+
+    @parser
+    def difference(input):
+        left = expr(input)
+        input.match('-')
+        return left - number(input)
+
+    expr.define(difference | number)
+    assert(expr('10-3-2') == 5)
+
+def test_rule_indirect_left_recursion():
+    a = rule()
+    b = rule()
+    a.define(b + 'x' | 'y')
+    b.define(a + 'z' | 'w')
+    assert(a('yzxzx') == 'yzxzx')
+    assert(a('wx') == 'wx')
+
+def test_rule_with_packrat():
+    expr = rule()
+    term = rule(digit)
+    expr.define(expr + '+' + term | term)
+    input = Input('1+2+3', memoize=True)
+    assert(expr(input) == '1+2+3')
+
+def test_rule_results_not_extended():
+    items = rule(sep_by(digit, ','))
+    assert((peek(items + ';') + items)('1,2;') == ['1', '2'])
+
+def test_rule_undefined():
+    with pytest.raises(RuntimeError, match='Rule expr has not been defined'):
+        rule(name='expr')('foo')
+
+# Test streaming input
+def chunked(s, size):
+    for i in range(0, len(s), size):
+        yield s[i:i + size]
+
+def test_stream_from_file():
+    import io
+    p = many(regex('[a-z]+') + ';')
+    assert(p(io.StringIO('foo;bar;baz;')) == 'foo;bar;baz;')
+
+def test_stream_tokens_across_chunks():
+    p = constant('foobar') + regex('[0-9]+') + eof
+    assert(p(chunked('foobar123456', 4)) == 'foobar123456')
+
+def test_stream_binary_file():
+    import io
+    p = sep_by(regex(b'[0-9]+'), b',')
+    assert(p(io.BytesIO(b'1,22,333')) == [b'1', b'22', b'333'])
+
+def test_stream_discards_consumed_input():
+    record = regex('[a-z]+\n')
+    input = StreamInput(chunked('abc\n' * 1000, 16), lookahead=8)
+    for i in range(0, 1000):
+        assert(record(input) == 'abc\n')
+        assert(len(input.buffer) < 64)
+    assert(not input)
+
+def test_stream_many_discards_parsed_input():
+    sizes = []
+    def source():
+        chunks = chunked('abc\n' * 1000, 16)
+        yield next(chunks)
+        for chunk in chunks:
+            sizes.append(len(input.buffer))
+            yield chunk
+    record = regex('[a-z]+\n') >> (lambda r: [r])
+    input = StreamInput(source(), lookahead=8)
+    assert(many(record)(input) == ['abc\n'] * 1000)
+    assert(max(sizes) < 64)
+
+def test_stream_held_input_grows_geometrically():
+    sizes = []
+    def source():
+        chunks = chunked('abc\n' * 1000, 16)
+        yield next(chunks)
+        for chunk in chunks:
+            sizes.append(len(input.buffer))
+            yield chunk
+    input = StreamInput(source(), lookahead=8)
+    assert(many(regex('[a-z]+\n'), at_least=1000)(input) == 'abc\n' * 1000)
+    # Each time the buffer is rebuilt, it at least doubles
+    assert(len(set(sizes)) < 20)
+
+def test_stream_keeps_input_for_backtracking():
+    p = one_of([constant('ab') * 10 + 'x', constant('ab') * 10 + 'y'])
+    assert(p(chunked('ab' * 10 + 'y', 3)) == 'ab' * 10 + 'y')
+
+# Test incremental record parsing
+def test_parse_iter_terminator():
+    record = regex('[a-z]+')
+    assert(list(record.parse_iter('foo;bar;baz;', terminator=';')) == ['foo', 'bar', 'baz'])
+
+def test_parse_iter_separator():
+    record = regex('[0-9]+') >> int
+    assert(list(record.parse_iter('1,2,3', separator=',')) == [1, 2, 3])
+
+@pytest.mark.xfail(raises=ParserError)
+def test_parse_iter_trailing_separator():
+    list(regex('[0-9]+').parse_iter('1,2,', separator=','))
+
+def test_parse_iter_is_lazy():
+    pulled = []
+    def source():
+        for i in range(0, 1000):
+            pulled.append(i)
+            yield 'line {}\n'.format(i)
+
+    records = regex('line [0-9]+\n').parse_iter(source())
+    assert(next(records) == 'line 0\n')
+    assert(len(pulled) < 1000)
+    assert(len(list(records)) == 999)
+
+@pytest.mark.xfail(raises=ParserError)
+def test_parse_iter_no_progress():
+    list(optional('x').parse_iter('abc'))
+
+# Test binary and memory-mapped input
+def test_bytes_input():
+    p = constant(b'GET') + b' ' + regex(b'[^ ]+')
+    assert(p(b'GET /index.html') == b'GET /index.html')
+
+def test_bytearray_input():
+    assert(many(regex(b'[0-9]'))(bytearray(b'123x')) == bytearray(b'123'))
+
+def test_mmap_input(tmp_path):
+    import mmap
+    path = tmp_path / 'data'
+    path.write_bytes(b'key=value\n' * 100)
+    with open(str(path), 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        line = regex(b'[a-z]+') + b'=' + regex(b'[a-z]+') + b'\n'
+        input = Input.coerce(mapped)
+        assert(type(input) is Input)
+        assert(input.buffer is mapped)
+        assert(list(line.parse_iter(mapped)) == [b'key=value\n'] * 100)
+        assert(line(mapped) == b'key=value\n')
+        assert(mapped.tell() == 0)
+        mapped.close()
+
+def test_memoryview_input_returns_views():
+    data = b'foo bar'
+    result = regex(b'[a-z]+')(memoryview(data))
+    assert(isinstance(result, memoryview))
+    assert(result == b'foo')
+    assert((regex(b'[a-z]+') + b' ' + b'bar')(memoryview(data)) == data)
+
+def test_not_on_bytes():
+    assert(many(not_(b';'))(b'abc;') == b'abc')
+
+# Test error reporting
+def test_error_message():
+    with pytest.raises(ParserError) as error:
+        constant('foo')('bar')
+    assert(str(error.value) == "Expected 'foo' but received 'bar' at line 1, column 1")
+
+def test_error_end_of_input():
+    with pytest.raises(EndOfInputError) as error:
+        (constant('foo') + 'bar')('foo')
+    assert(str(error.value) == "Expected 'bar' but encountered end of input at line 1, column 4")
+
+def test_error_is_structured():
+    p = regex('[0-9]+', desc='number')
+    input = Input('abc')
+    with pytest.raises(ParserError) as error:
+        p(input)
+    assert(error.value.pos == 0)
+    assert(error.value.parser is p)
+    assert(error.value.input is input)
+    assert(error.value._message is None)
+    assert(str(error.value) == "Expected number but received 'abc' at line 1, column 1")
+
+def test_error_repr():
+    with pytest.raises(ParserError) as error:
+        constant('foo')('bar')
+    assert(repr(error.value) == "ParserError(\"Expected 'foo' but received 'bar' at line 1, column 1\")")
+    assert(repr(EndOfInputError('Expected foo')) == "EndOfInputError('Expected foo')")
+
+def test_error_excerpt_is_bounded():
+    with pytest.raises(ParserError) as error:
+        constant('foo')('x' * 100000)
+    assert(len(str(error.value)) < 100)
+
+def test_error_line_and_column():
+    p = many(regex('[a-z]+') + '\n') + eof
+    with pytest.raises(ParserError) as error:
+        p('abc\ndef\ngh1\n')
+    assert((error.value.line, error.value.column) == (3, 3))
+
+def test_error_reports_furthest_failure():
+    p = one_of([constant('foo') + 'bar', constant('foo') + 'baz', 'qux'])
+    with pytest.raises(ParserError) as error:
+        p('foobax')
+    assert(error.value.pos == 3)
+    assert(str(error.value) == "Expected 'bar' or 'baz' but received 'bax' at line 1, column 4")
+
+def test_error_merges_expected_at_furthest():
+    with pytest.raises(ParserError) as error:
+        (many(digit) + eof)('12a')
+    assert(str(error.value) == "Expected digit or end of input but received 'a' at line 1, column 3")
+    with pytest.raises(ParserError) as error:
+        one_of([constant('x') + '1', constant('y') + '2'])('z')
+    assert(str(error.value) == "Expected 'x' or 'y' but received 'z' at line 1, column 1")
+    with pytest.raises(ParserError) as error:
+        ('a' + one_of([constant('b') + 'c', 'd']))('ax')
+    assert(str(error.value) == "Expected 'b' or 'd' but received 'x' at line 1, column 2")
+
+def test_error_expected_is_a_snapshot():
+    p = one_of([constant('foo') + 'bar', constant('foo') + 'baz', 'qux'])
+    input = Input('foobax')
+    with pytest.raises(ParserError) as error:
+        p(input)
+    input.pos = 0
+    with pytest.raises(ParserError):
+        (constant('foo') + 'bay')(input)
+    assert(str(error.value) == "Expected 'bar' or 'baz' but received 'bax' at line 1, column 4")
+
+def test_error_stream_line_and_column():
+    lines = ['line {}\n'.format(i) for i in range(0, 1000)] + ['oops\n']
+    p = many(regex('line [0-9]+\n')) + eof
+    with pytest.raises(ParserError) as error:
+        p(StreamInput(iter(lines), lookahead=16))
+    assert((error.value.line, error.value.column) == (1001, 1))
+
+# Test grammar compilation
+def test_compile_flattens_sequences():
+    p = sequence([regex('[a-z]'), sequence([digit, sequence([letter, digit])])])
+    compiled = p.compile()
+    assert(len(compiled.parsers) == 4)
+    assert(compiled('a1b2') == p('a1b2'))
+
+def test_compile_flattens_one_of():
+    p = one_of(['a', one_of(['b', one_of(['c', 'd'])])])
+    compiled = p.compile()
+    assert(len(compiled.parsers) == 4)
+    assert(compiled('d') == 'd')
+
+def test_compile_merges_constants():
+    p = constant('foo') + 'bar' + 'baz' + digit
+    compiled = p.compile()
+    assert(len(compiled.parsers) == 2)
+    assert(compiled.parsers[0].value == 'foobarbaz')
+    assert(compiled('foobarbaz1') == 'foobarbaz1')
+
+def test_compile_merged_constants_fail_alike():
+    p = constant('foo') + 'bar'
+    compiled = p.compile()
+    for text in ['fooba', 'foobaz', 'fo']:
+        with pytest.raises(ParserError) as expected:
+            p(text)
+        with pytest.raises(ParserError) as actual:
+            compiled(text)
+        assert(type(actual.value) == type(expected.value))
+        assert(str(actual.value) == str(expected.value))
+
+def test_compile_fuses_many_regex():
+    p = many(regex('[a-z]'))
+    compiled = p.compile()
+    assert(isinstance(compiled, regex))
+    assert(compiled('abc1') == 'abc')
+    assert(compiled('1') is Nil)
+
+def test_compile_fuses_many_at_least():
+    p = many('ab', at_least=1)
+    compiled = p.compile()
+    assert(isinstance(compiled, regex))
+    assert(compiled('ababa') == 'abab')
+    with pytest.raises(ParserError):
+        compiled('ba')
+
+def test_compile_trimmed():
+    p = trimmed('foo')
+    assert(p.compile()('  foo  ') == 'foo')
+
+def test_compile_repeat():
+    p = repeat(constant('ab'), 3)
+    compiled = p.compile()
+    assert(isinstance(compiled, constant))
+    assert(compiled('ababab') == 'ababab')
+
+def test_compile_rule():
+    expr = rule()
+    expr.define(expr + '+' + many(digit, at_least=1) | many(digit, at_least=1))
+    compiled = expr.compile()
+    assert(compiled is not expr)
+    assert(compiled('12+3+45') == '12+3+45')
+
+def test_compile_leaves_original():
+    inner = constant('b') + 'c'
+    p = sequence(['a', inner])
+    p.compile()
+    assert(len(p.parsers) == 2)
+    assert(len(inner.parsers) == 2)
+
+# Test fused alternatives
+def test_one_of_fuses_literals():
+    keywords = ['kw{};'.format(i) for i in range(0, 300)]
+    p = one_of(keywords)
+    assert(p('kw299;') == 'kw299;')
+    assert(one_of(['kw2', 'kw299'])('kw299') == 'kw2')
+    assert(len(p._fused[1]) == 1)
+
+def test_one_of_fused_keeps_order():
+    p = one_of(['foo', 'foobar', regex('f[a-z]+')])
+    assert(p('foobar') == 'foo')
+    p = one_of([regex('f[a-z]+'), 'foo'])
+    assert(p('foobar') == 'foobar')
+
+def test_one_of_fuses_runs_only():
+    p = one_of(['a', 'b', many(digit, at_least=1), 'c', regex('(d)')])
+    assert(p('c') == 'c')
+    assert(p('12') == '12')
+    assert(p('d') == 'd')
+    assert(len(p._fused[1]) == 4)
+
+def test_one_of_fused_failure():
+    with pytest.raises(ParserError) as error:
+        one_of(['foo', 'bar'])('baz')
+    assert(str(error.value) == "Expected 'foo' or 'bar' but received 'baz' at line 1, column 1")
+
+def test_one_of_fused_on_lists():
+    p = constant('a') | 'b' | 'c'
+    with pytest.raises(ParserError):
+        p(['a'])
+    assert((p | constant(['a']))(['a']) == ['a'])
+
+def test_one_of_sees_new_alternatives():
+    p = one_of(['a', 'b'])
+    assert(p('a') == 'a')
+    p.parsers.append(constant('c'))
+    assert(p('c') == 'c')
+    p.parsers = [constant('d')]
+    assert(p('d') == 'd')
+
+def test_one_of_shared_between_threads():
+    import concurrent.futures
+    keywords = ['kw{:03}'.format(i) for i in range(300)]
+    values = keywords * 4
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        for _ in range(20):
+            p = one_of(keywords)
+            assert(list(p.parse_many(values, executor=executor, batch_size=1)) == values)
+
+def test_one_of_fused_bytes():
+    p = one_of([b'GET', b'POST', regex(b'P[A-Z]+')])
+    assert(p(b'PUT') == b'PUT')
+
+# Test first sets and dispatch
+def test_first_sets():
+    assert(constant('foo').first() == (frozenset(['f']), False))
+    assert(regex('[a-c]x|y').first() == (frozenset(['a', 'b', 'c', 'y']), False))
+    assert(regex('[a-z]*').first()[1])
+    assert(regex('\\w').first()[0] is None)
+    assert((optional('a') + 'b').first() == (frozenset(['a', 'b']), False))
+    assert(many('a').first() == (frozenset(['a']), True))
+    assert(regex(b'ab').first() == (frozenset([b'a']), False))
+
+def test_first_of_recursive_rule():
+    expr = rule()
+    expr.define(expr + '+' + digit | '(' + expr + ')' | digit)
+    assert(expr.first() == (None, True))
+    value = rule()
+    value.define('[' + sep_by(value, ',') + ']' | digit)
+    assert(value.first()[0] == frozenset(['[', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9']))
+
+def test_one_of_dispatch_skips_branches():
+    calls = []
+
+    @parser
+    def tracked(input):
+        calls.append(input.pos)
+        raise ParserError('never matches')
+
+    p = one_of(['x' + tracked, 'y' + regex('[0-9]+'), optional('z') + ';'])
+    assert(p('y12') == 'y12')
+    assert(p(';') == ';')
+    assert(calls == [])
+    with pytest.raises(ParserError):
+        p('x')
+    assert(calls == [1])
+
+def test_one_of_dispatch_unknown_branches():
+    p = one_of([constant('a') + 'b', not_('c'), 'c'])
+    assert(p('ab') == 'ab')
+    assert(p('q') == 'q')
+    assert(p('c') == 'c')
+
+def test_one_of_dispatch_end_of_input():
+    p = one_of(['a', eof])
+    assert(p('') == '')
+
+# Result accumulation
+def test_empty_results_are_nil():
+    assert(many('a')('') is Nil)
+    assert((optional('a') + optional('b'))('') is Nil)
+    assert(until('x')('x') is Nil)
+
+def test_until_returns_slice():
+    import io
+    assert(until(';')('abc;') == 'abc')
+    assert(until(b';')(memoryview(b'abc;')) == b'abc')
+    assert(until(';')(StreamInput(io.StringIO('abc;'), chunk_size=2, lookahead=1)) == 'abc')
+
+def test_long_accumulation():
+    text = 'a' * 200000
+    assert(many('a')(text) == text)
+    assert(until('b')(text + 'b') == text)
+    assert(repeat('a', 1000)('a' * 1000) == 'a' * 1000)
+    assert(many(regex(b'a'))(text.encode()) == text.encode())
+
+# Scanning by search
+def test_until_search():
+    assert(until('*/')('a * b / c */') == 'a * b / c ')
+    assert(until(regex('[0-9]+'))('abc123') == 'abc')
+    assert(until('x')('abc') == 'abc')
+    assert(until(b'--')(memoryview(b'a-b--c')) == b'a-b')
+    assert(until(';')(b'abc;') == b'abc;')
+
+def test_until_search_stream():
+    text = 'x' * 100 + '-' * 3 + 'end' + 'y' * 100
+    for size in (1, 2, 7, 64):
+        assert(until('end')(StreamInput(chunked(text, size), lookahead=4)) == text[:103])
+        assert(until(regex('-+e'))(StreamInput(chunked(text, size), lookahead=4)) == text[:100])
+        assert(until('none')(StreamInput(chunked(text, size), lookahead=4)) == text)
+
+def test_many_not_search():
+    p = many(not_('"'))
+    assert(p('abc"def') == 'abc')
+    assert(p('"') is Nil)
+    assert(many(not_(regex('[ \t]')), at_least=1)('word rest') == 'word')
+    with pytest.raises(ParserError):
+        many(not_(';'), at_least=4)('abc;')
+    with pytest.raises(ParserError) as e:
+        ('"' + many(not_('"')) + '"')('"abc')
+    assert(e.value.pos == 4)
+
+# Parse trees
+def test_tree_mode():
+    number = rule(regex('[0-9]+'), name='number')
+    expr = rule(name='expr')
+    expr.define(expr + '+' + number | number)
+    assert(expr('1+22') == '1+22')
+    tree = expr('1+22', tree=True)
+    assert(tree.name == 'expr' and (tree.start, tree.end) == (0, 4))
+    assert([child.name for child in tree.children] == ['expr', 'number'])
+    assert(tree.children[1].text == '22')
+    assert(tree.children[0] == Node('expr', 0, 1, (Node('number', 0, 1),)))
+
+def test_tree_mode_lists():
+    item = rule(regex('[a-z]+'), name='item')
+    items = rule('[' + sep_by(item, ',') + ']', name='items')
+    tree = items('[ab,c]', tree=True)
+    assert([child.text for child in tree.children] == ['ab', 'c'])
+    assert(items('[]', tree=True).children == ())
+
+def test_tree_mode_stream():
+    word = rule(regex('[a-z]+'), name='word')
+    words = list(word.parse_iter(chunked('ab cd ef', 3), separator=' ', tree=True))
+    assert([(node.start, node.end) for node in words] == [(0, 2), (3, 5), (6, 8)])
+
+# Compact objects
+def test_slotted_objects():
+    for obj in (Input('abc'), constant('a'), regex('a'), many('a'), 'a' + digit, 'a' | digit,
+                rule(), Match('a', 'a'), Nil):
+        assert(not hasattr(obj, '__dict__'))
+
+def test_match_span():
+    input = Input('foobar')
+    input.consume(3)
+    match = input.match('bar')
+    assert((match.start, match.end) == (3, 6))
+    assert(match.matched == 'bar')
+    assert(sep_by(regex('[a-z]+'), ',')('ab,c')[1].matched == 'c')
+
+# Profiling
+def test_profiler_counts():
+    @parser
+    def word(input):
+        return input.match(regex('[a-z]+')).result
+
+    call, rollback = Parser.__call__, Input.rollback
+    p = sep_by(word, ',')
+    with Profiler() as profiler:
+        assert(p('ab,cd;') == ['ab', 'cd'])
+    assert(Parser.__call__ is call and Input.rollback is rollback)
+
+    stats = profiler.stats[word]
+    assert((stats.calls, stats.successes, stats.failures) == (2, 2, 0))
+    assert(profiler.stats[p.parser2].failures == 1)
+    assert(stats.consumed == 4)
+    assert(stats.name == 'word')
+    assert(profiler.stats[p].backtracks == 1)
+    assert(profiler.results()[0].parser is p)
+    assert('word' in profiler.report())
+
+def test_profiler_pipes():
+    number = regex('[0-9]+') >> int
+    p = sep_by(number, ',')
+    call = Pipe.__call__
+    with Profiler() as profiler:
+        assert(p('1,2,3') == [1, 2, 3])
+    assert(Pipe.__call__ is call)
+    assert(profiler.stats[number].successes == 3)
+    assert(profiler.stats[number].consumed == 3)
+    assert(profiler.stats[number.in_fn].calls == 3)
+
+def test_profiler_recursion():
+    expr = rule(name='expr')
+    expr.define(expr + '+' + digit | digit)
+    with Profiler() as profiler:
+        expr('1+2+3')
+    assert(profiler.stats[expr].calls == 5)
+    # The last growing step fails, falling back on the first digit
+    assert(profiler.stats[digit].successes == 4)
+
+# Parallel parsing
+@parser
+def csv_row(input):
+    return input.match(sep_by(regex('[0-9]+'), ',')).matched
+
+def csv_grammar():
+    return sep_by(regex(b'[0-9]+') >> int, b',')
+
+def test_pickle_parsers():
+    import pickle
+    grammar = many(escaped('"') | not_('"')) + trimmed(csv_row) | 'x'
+    copy = pickle.loads(pickle.dumps(grammar))
+    assert(copy('ab\\" 1,2 ') == grammar('ab\\" 1,2 '))
+    assert(pickle.loads(pickle.dumps(csv_row)) is csv_row)
+
+    @parser
+    def local(input):
+        return input.consume(1)
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(local)
+
+def test_parse_parallel():
+    text = '\n'.join('{},{}'.format(i, i * 2) for i in range(1000)) + '\n'
+    expected = list(csv_row.parse_iter(text.rstrip('\n'), separator='\n'))
+    assert(list(parse_parallel(csv_row, text, workers=2, chunk_size=500)) == expected)
+    assert(list(parse_parallel(csv_grammar, text.encode(), boundary=regex(b'\n+'),
+                               workers=2, chunk_size=100))[3] == [3, 6])
+
+def test_parse_parallel_file(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_bytes(b'1,2\n3,4\n5,x\n7,8\n')
+    with open(path, 'rb') as file:
+        with pytest.raises(ParserError) as e:
+            list(parse_parallel(csv_grammar, file, boundary=b'\n', workers=2, chunk_size=4))
+    assert(e.value.pos == 10)
+    assert((e.value.line, e.value.column) == (3, 3))
+
+def test_parse_parallel_mmap(tmp_path):
+    import mmap
+    path = tmp_path / 'data.csv'
+    path.write_bytes(b'1,2\n3,4\n' * 50)
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        results = list(parse_parallel(csv_grammar, mapped, workers=2, chunk_size=64))
+        assert(results == [[1, 2], [3, 4]] * 50)
+        assert(mapped.tell() == 0 and not mapped.closed)
+        mapped.close()
+
+# Batches
+def test_parse_many():
+    number = regex('[0-9]+') >> int
+    assert(list(number.parse_many(['1', '22', '333'])) == [1, 22, 333])
+    assert(list(number.parse_many(['1', 'x', '3'], errors='skip')) == [1, 3])
+    results = list(number.parse_many(['1', 'x', '3'], errors='return'))
+    assert(results[0] == 1 and results[2] == 3)
+    assert(isinstance(results[1], ParserError) and 'received' in str(results[1]))
+    with pytest.raises(ParserError):
+        list(number.parse_many(['1', 'x']))
+    with pytest.raises(ValueError):
+        list(number.parse_many(['1'], errors='ignore'))
+
+def test_parse_many_memoized():
+    expr = rule()
+    expr.define(expr + '-' + digit | digit)
+    table = MemoTable()
+    assert(list(expr.parse_many(['1-2', '3', 'x-1'], errors='return', memoize=table))[:2] == ['1-2', '3'])
+
+def test_parse_many_executor():
+    import concurrent.futures
+    values = [str(i) for i in range(50)] + ['x']
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        results = list(regex(b'[0-9]+').parse_many([v.encode() for v in values], errors='return',
+                                                    executor=executor, batch_size=7))
+    assert(results[:50] == [v.encode() for v in values[:50]])
+    assert(isinstance(results[50], ParserError) and results[50].pos == 0)
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert(list(digit.parse_many('123', executor=executor, batch_size=2)) == ['1', '2', '3'])
+
+def test_parse_many_executor_is_lazy():
+    import concurrent.futures
+    import itertools
+    pulled = []
+    def values():
+        for i in itertools.count():
+            pulled.append(i)
+            yield str(i % 10)
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        results = digit.parse_many(values(), executor=executor, batch_size=10)
+        assert(list(itertools.islice(results, 25)) == [str(i % 10) for i in range(25)])
+        results.close()
+    assert(len(pulled) < 10000)
+
+# Asynchronous input
+def test_parse_async():
+    import asyncio
+    received = []
+
+    async def chunks():
+        for chunk in chunked(b'12;345;6;', 2):
+            received.append(chunk)
+            yield chunk
+
+    async def parse():
+        results = []
+        async for result in regex(b'[0-9]+').parse_async(chunks(), terminator=b';', lookahead=0):
+            results.append((result, len(received)))
+        return results
+
+    # Each record is ready as soon as its terminator has arrived
+    assert(asyncio.run(parse()) == [(b'12', 2), (b'345', 4), (b'6', 5)])
+
+def test_parse_async_stream_reader():
+    import asyncio
+
+    async def parse():
+        reader = asyncio.StreamReader()
+        for chunk in chunked('1-2-3\n4\n5-', 3):
+            reader.feed_data(chunk.encode())
+        reader.feed_eof()
+        results = []
+        async for result in regex(b'[^\n]+').parse_async(reader, separator=b'\n', chunk_size=2):
+            results.append(result)
+        return results
+
+    assert(asyncio.run(parse()) == [b'1-2-3', b'4', b'5-'])
+
+def test_parse_async_errors():
+    import asyncio
+
+    async def chunks():
+        yield 'ab\n'
+        yield 'c1\nd'
+
+    async def parse():
+        return [r async for r in regex('[a-z]+').parse_async(chunks(), separator='\n')]
+
+    with pytest.raises(ParserError) as e:
+        asyncio.run(parse())
+    assert((e.value.line, e.value.column) == (2, 2))
+
+def test_parse_async_work_per_chunk():
+    import asyncio
+    text = ('abcdefg;' * 200 + '\n') * 3
+
+    async def chunks():
+        for chunk in chunked(text, 16):
+            yield chunk
+
+    async def parse():
+        return [r async for r in many(regex('[a-z]+') + ';').parse_async(chunks(), terminator='\n')]
+
+    with Profiler() as profiler:
+        assert(asyncio.run(parse()) == [text[:1600]] * 3)
+    # Each record resumes where it was interrupted, rather than starting over
+    assert(sum(entry.calls for entry in profiler.results()) < 6 * 600)
+
+# Resumable parsing
+def test_parse_resumable():
+    p = many(regex('[a-z]+') + ',')
+    state = p.parse_resumable('ab,c', lookahead=0)
+    assert(isinstance(state, Suspended))
+    state = state.feed('d,e')
+    assert(isinstance(state, Suspended))
+    assert(state.feed(',').close() == 'ab,cd,e,')
+
+    message = regex(b'[A-Z]+') + b'\r\n'
+    result = message.parse_resumable(b'PI', lookahead=0).feed(b'NG\r\nPO')
+    assert(isinstance(result, Partial))
+    assert((result.result, result.remainder) == (b'PING\r\n', b'PO'))
+    assert(message.parse_resumable(b'OK\r\n', lookahead=0) == b'OK\r\n')
+
+def test_parse_resumable_reuses_progress():
+    calls = []
+
+    @parser
+    def item(input):
+        calls.append(input.pos)
+        return input.match(regex('[a-z]+')).matched
+
+    text = 'abc,' * 50
+    state = many(item + ',').parse_resumable(text[0], lookahead=0)
+    for c in text[1:]:
+        state = state.feed(c)
+    assert(state.close() == text)
+    # Only the item still being read is parsed again on each feed
+    assert(len(calls) == len(text))
+
+def test_parse_resumable_work_per_feed():
+    text = 'abcdefg;' * 500
+    for memoize in (False, True):
+        state = many(regex('[a-z]+') + ';').parse_resumable(text[:4], memoize=memoize)
+        calls = []
+        for i in range(4, len(text), 4):
+            with Profiler() as profiler:
+                state = state.feed(text[i:i + 4])
+            calls.append(sum(entry.calls for entry in profiler.results()))
+        assert(state.close() == text)
+        # Resuming goes straight back to the unfinished record
+        assert(max(calls) <= 10)
+        if memoize:
+            assert(state.input.memo.hits == 0)
+
+def test_parse_resumable_backtracking():
+    p = one_of([many(letter) + '1', many(letter) + '2', regex('[a-z]+3')])
+    expr = rule(name='expr')
+    expr.define(expr + '-' + digit | digit)
+    for grammar, text in ((p, 'abcdef2'), (p, 'abcdef3'), (expr + ';', '1-2-3-4;')):
+        for memoize in (False, True):
+            state = grammar.parse_resumable(text[0], memoize=memoize, lookahead=0)
+            for c in text[1:]:
+                state = state.feed(c)
+            if isinstance(state, Suspended):
+                state = state.close()
+            assert(state == grammar(text))
+
+def test_parse_resumable_errors():
+    state = (digit + ';').parse_resumable('1', lookahead=0)
+    with pytest.raises(ParserError):
+        state.feed('x')
+    with pytest.raises(EndOfInputError):
+        (digit + ';').parse_resumable('1').close()
+
+
+# Incremental reparsing
+def test_incremental_reparse():
+    calls = []
+
+    @parser
+    def value(input):
+        calls.append(input.pos)
+        return input.match(regex('[0-9]+')).matched
+
+    entry = rule(regex('[a-z]+') + ' = ' + value, name='entry')
+    config = rule(many(entry + '\n'), name='config')
+    text = ''.join('{} = {}\n'.format('k' * (1 + i % 5), i) for i in range(500))
+    document = IncrementalInput(text, tree=True, lookahead=4)
+    tree = document.parse(config)
+    assert(len(tree.children) == 500 and len(calls) == 500)
+
+    del calls[:]
+    document.edit(text.index('= 250\n') + 2, 3, '12345')
+    tree = document.parse(config)
+    assert(len(calls) == 1)
+    assert(tree.children[250].text == 'k = 12345')
+    assert(tree.children[499].end == len(text) + 1)
+    assert(tree == IncrementalInput(document.buffer, tree=True).parse(config))
+
+def test_incremental_keeps_old_trees():
+    entry = rule(regex('[a-z]+') + ';', name='entry')
+    doc = rule(many(entry), name='doc')
+    document = IncrementalInput('ab;cd;ef;', tree=True)
+    old = document.parse(doc)
+    document.edit(0, 0, 'xx')
+    new = document.parse(doc)
+    assert(old == Node('doc', 0, 9, (Node('entry', 0, 3), Node('entry', 3, 6), Node('entry', 6, 9))))
+    assert(new == Node('doc', 0, 11, (Node('entry', 0, 5), Node('entry', 5, 8), Node('entry', 8, 11))))
+
+def test_incremental_edit_time():
+    entry = rule(regex('[a-z]+') + ' = ' + regex('[0-9]+'), name='entry')
+    config = rule(many(entry + '\n'), name='config')
+    text = ''.join('{} = {}\n'.format('k' * (1 + i % 5), i) for i in range(5000))
+    document = IncrementalInput(text, tree=True)
+    started = time.perf_counter()
+    document.parse(config)
+    parsed = time.perf_counter() - started
+    for offset in (2, len(text) // 2, len(text) - 2):
+        started = time.perf_counter()
+        document.edit(offset, 1, '7')
+        assert(time.perf_counter() - started < parsed / 20)
+        text = text[:offset] + '7' + text[offset + 1:]
+    assert(document.parse(config) == IncrementalInput(text, tree=True).parse(config))
+
+def test_incremental_failed_regex_reach():
+    grammar = many(one_of([regex('[a-z]+;'), constant('x') + 'y', regex('[a-z0-9]+')]))
+    document = IncrementalInput('a' * 2000 + '1')
+    assert(document.parse(grammar) == 'a' * 2000 + '1')
+    document.edit(2000, 1, ';')
+    assert(document.parse(grammar) == 'a' * 2000 + ';')
+
+@repeated
+def test_incremental_random_edits():
+    grammar = many(one_of([regex('[a-z]+'), regex('[0-9]{1,3}'), constant('(') + many(not_(')')) + ')', ' ']))
+    text = 'ab (cd 12) 3456 x (y)'
+    document = IncrementalInput(text, lookahead=2)
+    for i in range(5):
+        offset = randint(0, len(text))
+        deleted = randint(0, min(3, len(text) - offset))
+        inserted = ''.join('ab1 ()'[randint(0, 5)] for _ in range(randint(0, 3)))
+        text = text[:offset] + inserted + text[offset + deleted:]
+        document.edit(offset, deleted, inserted)
+        assert(document.parse(grammar) == grammar(text))
+
+# Generated code
+def calculator():
+    expr = rule(name='expr')
+    term = rule(name='term')
+    number = regex('[0-9]+') >> (lambda r: [int(r)])
+    factor = ignored('(') + expr + ignored(')') | number
+    term.define(term + ignored('*') + factor >> (lambda r: [r[0] * r[1]]) | factor)
+    expr.define(expr + ignored('+') + term >> (lambda r: [r[0] + r[1]]) | term)
+    return expr
+
+def test_generate():
+    row = sep_by(regex('[^,\n]*'), ',') >> (lambda r: [m.matched for m in r])
+    table = sep_by(row, '\n')
+    generated = table.generate(cache=False)
+    text = 'a,b,,c\n1,2\n\nx'
+    assert([m.result for m in generated(text)] == [m.result for m in table(text)])
+    assert(calculator().generate(cache=False)('2*(3+4)*5+1') == [71])
+
+@repeated
+def test_generate_errors():
+    grammar = many(one_of(['ab', regex('[0-9]+'), constant('(') + until(')') + ')']), at_least=1) + eof
+    generated = grammar.generate(cache=False)
+    text = ''.join('ab1()x'[randint(0, 5)] for _ in range(randint(0, 8)))
+    try:
+        expected = grammar(text)
+    except ParserError as e:
+        with pytest.raises(ParserError) as error:
+            generated(text)
+        assert(error.value.pos == e.pos)
+    else:
+        assert(generated(text) == expected)
+
+    grammar = repeat(one_of(['a', 'b']), 3) + optional(eof)
+    with pytest.raises(ParserError) as e:
+        grammar('a')
+    with pytest.raises(ParserError) as error:
+        grammar.generate(cache=False)('a')
+    assert(error.value.pos == e.value.pos == 1)
+    assert(str(error.value) == str(e.value))
+
+def test_generate_cache(tmp_path):
+    first = (regex('[0-9]+') >> int).generate(cache=tmp_path)
+    second = (regex('[0-9]+') >> float).generate(cache=tmp_path)
+    assert(first.path == second.path)
+    assert(len(list(tmp_path.glob('*.py'))) == 1)
+    assert(first('12') == 12 and type(second('12')) is float)
+
+def test_generate_falls_back():
+    generated = calculator().generate(cache=False)
+    assert(generated(Input('1+2', memoize=True)) == [3])
+    with pytest.raises(ParserError):
+        generated(b'1+2')
+    assert(generated(iter(['1', '+2'])) == [3])
+
+# Saving grammars
+def test_dump_grammar(tmp_path):
+    nested = rule(name='nested')
+    nested.define('(' + optional(nested) + ')' | regex('[a-z]+'))
+    path = tmp_path / 'grammar'
+    dump_grammar(nested | csv_row, path)
+    loaded = load_grammar(path)
+    assert(loaded('1,2') == '1,2' and loaded('((ab))') == '((ab))')
+    assert(loaded.parsers[0].parser.parsers[1].pattern == '[a-z]+')
+
+def test_load_grammar_builds(tmp_path):
+    built = []
+    def build():
+        built.append(True)
+        return many(regex('[a-z]+') | ' ')
+    path = tmp_path / 'grammar'
+    assert(load_grammar(path, build)('ab c') == 'ab c')
+    assert(load_grammar(path, build)('ab c') == 'ab c')
+    assert(len(built) == 1)
+
+def test_load_grammar_invalid(tmp_path):
+    path = tmp_path / 'grammar'
+    path.write_bytes(b'not a grammar')
+    with pytest.raises(ValueError):
+        load_grammar(path)
+
+# Shared parsers
+def test_regex_compiled_lazily():
+    parser = regex('(')
+    with pytest.raises(re.error):
+        parser('(')
+    assert(regex('[0-9]+').regexp is regex('[0-9]+', desc='number').regexp)
+
+def test_shared_factories():
+    assert(escaped('"') is escaped('"'))
+    parser = trimmed('x')
+    assert(trimmed('x') is parser)
+    extended = constant('a') + parser + 'y'
+    assert(extended('a x y') == 'axy')
+    assert(len(parser.parsers) == 3 and parser(' x ') == 'x')